@@ -0,0 +1,334 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from evaluate_clones import SCRIPT_DIR, clone_type_label, resolve_benchmark_path
+
+# Версия формата индекса: при изменении структуры файлов индекс пересобирается автоматически
+INDEX_FORMAT_VERSION = 2
+# Суффикс директории индекса рядом с эталонным CSV (clones_2017.csv -> clones_2017.csv.index/)
+INDEX_DIR_SUFFIX = '.index'
+HASH_CHUNK_BYTES = 1024 * 1024
+# Файлы индекса: при отсутствии любого из них индекс считается устаревшим
+INDEX_FILES = ['meta.json', 'paths.txt', 'tasks.txt', 'strata.txt', 'pairs.npy', 'keys.npy',
+               'task_file_offsets.npy', 'task_file_ids.npy']
+
+# Структура одной эталонной пары в индексе. Пары хранятся в каноническом виде (f1 <= f2 по номеру пути;
+# таблица путей отсортирована, поэтому порядок номеров совпадает с порядком строк путей)
+# и отсортированы по key = f1 << 32 | f2, затем по seq (номеру строки в CSV).
+PAIR_DTYPE = np.dtype([
+    ('key', '<u8'),
+    ('seq', '<i8'),
+    ('f1', '<i4'), ('s1', '<i4'), ('e1', '<i4'),
+    ('f2', '<i4'), ('s2', '<i4'), ('e2', '<i4'),
+    ('task', '<i4'),
+    ('stratum', '<i2'),
+    ('weight', '<f8'),
+    ('clone_type', '<i1'),
+])
+
+def get_index_dir(benchmark_csv):
+    """Директория индекса рядом с эталонным CSV."""
+    return os.path.abspath(benchmark_csv) + INDEX_DIR_SUFFIX
+
+def compute_file_hash(file_path):
+    """SHA-256 содержимого файла (потоковое чтение)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_lines(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read().split('\n')[:-1]
+
+def _write_lines(file_path, lines):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(f"{line}\n")
+
+def build_benchmark_index(benchmark_csv, index_dir, content_hash=None):
+    """
+    Строит индекс эталонного CSV:
+    paths.txt - отсортированная таблица разрешенных путей (номер пути = номер строки),
+    tasks.txt, strata.txt - таблицы task_id и страт размера,
+    pairs.npy - структурированный массив PAIR_DTYPE,
+    keys.npy - непрерывная копия pairs['key'] для бинарного поиска по memmap без копирования,
+    task_file_offsets.npy, task_file_ids.npy - номера файлов каждой задачи (CSR),
+    meta.json - версия формата, хеш и размер CSV.
+    Индекс собирается во временной директории и подменяет старый только после успешной записи.
+    """
+    started = time.perf_counter()
+    stat = os.stat(benchmark_csv)
+    if content_hash is None:
+        content_hash = compute_file_hash(benchmark_csv)
+
+    df = pd.read_csv(benchmark_csv, dtype={'task_id': str, 'size_stratum': str})
+    resolved_1 = df['file1_path'].map(resolve_benchmark_path).to_numpy(dtype=object)
+    resolved_2 = df['file2_path'].map(resolve_benchmark_path).to_numpy(dtype=object)
+    paths = sorted(set(resolved_1) | set(resolved_2))
+    path_ids = {path: i for i, path in enumerate(paths)}
+    ids_1 = np.fromiter((path_ids[p] for p in resolved_1), dtype=np.int64, count=len(df))
+    ids_2 = np.fromiter((path_ids[p] for p in resolved_2), dtype=np.int64, count=len(df))
+
+    # Канонический порядок: файл с меньшим номером (меньшим путем) первым
+    swap = ids_1 > ids_2
+    pairs = np.empty(len(df), dtype=PAIR_DTYPE)
+    coords = {col: df[col].to_numpy(dtype=np.int64) for col in ['file1_start', 'file1_end', 'file2_start', 'file2_end']}
+    pairs['f1'] = np.where(swap, ids_2, ids_1)
+    pairs['f2'] = np.where(swap, ids_1, ids_2)
+    pairs['s1'] = np.where(swap, coords['file2_start'], coords['file1_start'])
+    pairs['e1'] = np.where(swap, coords['file2_end'], coords['file1_end'])
+    pairs['s2'] = np.where(swap, coords['file1_start'], coords['file2_start'])
+    pairs['e2'] = np.where(swap, coords['file1_end'], coords['file2_end'])
+    pairs['key'] = (pairs['f1'].astype(np.uint64) << np.uint64(32)) | pairs['f2'].astype(np.uint64)
+    pairs['seq'] = np.arange(len(df), dtype=np.int64)
+
+    task_values = df['task_id'].fillna('').astype(str) if 'task_id' in df.columns else pd.Series([''] * len(df))
+    task_codes, tasks = pd.factorize(task_values, sort=True)
+    pairs['task'] = task_codes
+
+    has_weights = 'weight' in df.columns
+    if has_weights:
+        strata_values = df['size_stratum'].fillna('all') if 'size_stratum' in df.columns else pd.Series(['all'] * len(df))
+        strata_codes, strata = pd.factorize(strata_values, sort=True)
+        pairs['stratum'] = strata_codes
+        pairs['weight'] = df['weight'].to_numpy(dtype=np.float64)
+    else:
+        strata = []
+        pairs['stratum'] = 0
+        pairs['weight'] = 1.0
+
+    has_clone_types = 'clone_type' in df.columns
+    if has_clone_types:
+        # Тип клона 1-4 из label_clone_types.py, 0 - не размечено
+        pairs['clone_type'] = pd.to_numeric(df['clone_type'], errors='coerce').fillna(0).to_numpy(dtype=np.int8)
+    else:
+        pairs['clone_type'] = 0
+
+    pairs = pairs[np.lexsort((pairs['seq'], pairs['key']))]
+
+    # Номера файлов каждой задачи (CSR: task_file_ids[offsets[t]:offsets[t + 1]])
+    task_files = pd.DataFrame({
+        'task': np.concatenate([task_codes, task_codes]),
+        'file': np.concatenate([ids_1, ids_2]),
+    }).drop_duplicates().sort_values(['task', 'file'])
+    task_file_offsets = np.searchsorted(task_files['task'].to_numpy(), np.arange(len(tasks) + 1)).astype(np.int64)
+
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    _write_lines(os.path.join(tmp_dir, 'paths.txt'), paths)
+    _write_lines(os.path.join(tmp_dir, 'tasks.txt'), list(tasks))
+    _write_lines(os.path.join(tmp_dir, 'strata.txt'), list(strata))
+    np.save(os.path.join(tmp_dir, 'pairs.npy'), pairs)
+    np.save(os.path.join(tmp_dir, 'keys.npy'), np.ascontiguousarray(pairs['key']))
+    np.save(os.path.join(tmp_dir, 'task_file_offsets.npy'), task_file_offsets)
+    np.save(os.path.join(tmp_dir, 'task_file_ids.npy'), task_files['file'].to_numpy(dtype=np.int32))
+    meta = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'benchmark_sha256': content_hash,
+        'benchmark_size': stat.st_size,
+        'benchmark_mtime_ns': stat.st_mtime_ns,
+        'script_dir': str(SCRIPT_DIR),
+        'num_pairs': int(len(pairs)),
+        'num_paths': len(paths),
+        'num_groups': int(len(np.unique(pairs['key']))),
+        'has_weights': has_weights,
+        'has_clone_types': has_clone_types,
+    }
+    _write_meta(os.path.join(tmp_dir, 'meta.json'), meta)
+
+    # Старый индекс сначала отодвигается в сторону и удаляется только после подмены: директория индекса
+    # отсутствует лишь между двумя переименованиями, а уже открытые читателями memmap-файлы остаются доступны
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Индекс эталона построен: {index_dir} ({len(pairs)} пар, {len(paths)} файлов) "
+          f"за {time.perf_counter() - started:.2f} с")
+    return meta
+
+def _write_meta(meta_path, meta):
+    """Атомарно записывает meta.json (временный файл + os.replace): параллельный читатель не увидит его наполовину."""
+    tmp_path = f"{meta_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, meta_path)
+
+def check_index_freshness(benchmark_csv, index_dir):
+    """
+    Проверяет актуальность индекса. Быстрая проверка - по размеру и времени изменения CSV;
+    если они изменились, сравнивается хеш содержимого (при совпадении обновляется только meta.json).
+    Возвращает: (актуален ли индекс, хеш CSV или None, если он не вычислялся)
+    """
+    meta_path = os.path.join(index_dir, 'meta.json')
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False, None
+    if meta.get('format_version') != INDEX_FORMAT_VERSION or meta.get('script_dir') != str(SCRIPT_DIR):
+        return False, None
+    if not all(os.path.exists(os.path.join(index_dir, name)) for name in INDEX_FILES):
+        return False, None
+
+    stat = os.stat(benchmark_csv)
+    if meta.get('benchmark_size') == stat.st_size and meta.get('benchmark_mtime_ns') == stat.st_mtime_ns:
+        return True, meta['benchmark_sha256']
+
+    content_hash = compute_file_hash(benchmark_csv)
+    if content_hash != meta.get('benchmark_sha256'):
+        return False, content_hash
+    meta['benchmark_size'] = stat.st_size
+    meta['benchmark_mtime_ns'] = stat.st_mtime_ns
+    try:
+        _write_meta(meta_path, meta)
+    except OSError:
+        pass
+    return True, content_hash
+
+class BenchmarkIndex:
+    """
+    Эталонный бенчмарк, загруженный из индекса через np.memmap (np.load с mmap_mode='r'):
+    массив пар не читается целиком, страницы подгружаются по мере обращения.
+    Поддерживает интерфейс словаря групп из evaluate_clones.group_clone_pairs:
+    index[(путь1, путь2)] -> (номера строк CSV, фрагменты), поэтому подходит для evaluate_tool_rows.
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.index_dir = index_dir
+        self.paths = _read_lines(os.path.join(index_dir, 'paths.txt'))
+        self.tasks = _read_lines(os.path.join(index_dir, 'tasks.txt'))
+        self.strata = _read_lines(os.path.join(index_dir, 'strata.txt'))
+        self.path_ids = {path: i for i, path in enumerate(self.paths)}
+        # np.asarray убирает накладные расходы подкласса np.memmap, данные остаются отображенными в память
+        self.pairs = np.asarray(np.load(os.path.join(index_dir, 'pairs.npy'), mmap_mode='r'))
+        self.keys = np.asarray(np.load(os.path.join(index_dir, 'keys.npy'), mmap_mode='r'))
+        self.task_file_offsets = np.load(os.path.join(index_dir, 'task_file_offsets.npy'), mmap_mode='r')
+        self.task_file_ids = np.load(os.path.join(index_dir, 'task_file_ids.npy'), mmap_mode='r')
+        self.total = int(self.meta['num_pairs'])
+
+    def __len__(self):
+        return int(self.meta['num_groups'])
+
+    def _slice(self, key):
+        id_1 = self.path_ids.get(key[0])
+        id_2 = self.path_ids.get(key[1])
+        if id_1 is None or id_2 is None:
+            return 0, 0
+        packed = np.uint64((id_1 << 32) | id_2)
+        lo = int(self.keys.searchsorted(packed, 'left'))
+        if lo == self.total or self.keys[lo] != packed:
+            return lo, lo
+        return lo, int(self.keys.searchsorted(packed, 'right'))
+
+    def __contains__(self, key):
+        lo, hi = self._slice(key)
+        return hi > lo
+
+    def __getitem__(self, key):
+        group = self.get(key)
+        if group is None:
+            raise KeyError(key)
+        return group
+
+    def get(self, key, default=None):
+        """Группа пары файлов: (номера строк CSV, фрагменты (start1, end1, start2, end2)) или default."""
+        lo, hi = self._slice(key)
+        if hi == lo:
+            return default
+        rows = self.pairs[lo:hi]
+        return rows['seq'].tolist(), list(zip(rows['s1'].tolist(), rows['e1'].tolist(), rows['s2'].tolist(), rows['e2'].tolist()))
+
+    def task_files(self, task_id):
+        """Пути файлов задачи."""
+        t = self.tasks.index(task_id)
+        return [self.paths[i] for i in self.task_file_ids[self.task_file_offsets[t]:self.task_file_offsets[t + 1]]]
+
+    def iter_sorted_records(self, chunk_size=65536):
+        """
+        Последовательно возвращает записи сортировки в формате evaluate_clones.iter_benchmark_records,
+        уже упорядоченные по (путь1, путь2, номер) - внешняя сортировка эталона не нужна.
+        """
+        for start in range(0, self.total, chunk_size):
+            chunk = self.pairs[start:start + chunk_size]
+            for key, seq, f1, s1, e1, f2, s2, e2, task in zip(
+                chunk['key'].tolist(), chunk['seq'].tolist(), chunk['f1'].tolist(), chunk['s1'].tolist(),
+                chunk['e1'].tolist(), chunk['f2'].tolist(), chunk['s2'].tolist(), chunk['e2'].tolist(),
+                chunk['task'].tolist()
+            ):
+                yield (self.paths[f1], self.paths[f2], seq, s1, e1, s2, e2, self.tasks[task])
+
+    def sampling_summary(self, matched_benchmark_seqs):
+        """Сводка весов выборки по стратам (как evaluate_clones.summarize_sampling_weights) или None, если весов нет."""
+        if not self.meta['has_weights']:
+            return None
+        strata_codes = self.pairs['stratum'].astype(np.int64)
+        weights = self.pairs['weight']
+        matched = np.isin(self.pairs['seq'], np.fromiter(matched_benchmark_seqs, dtype=np.int64, count=len(matched_benchmark_seqs)))
+        num_strata = len(self.strata)
+        counts = np.bincount(strata_codes, minlength=num_strata)
+        weight_sums = np.bincount(strata_codes, weights=weights, minlength=num_strata)
+        weight_tp_sums = np.bincount(strata_codes[matched], weights=weights[matched], minlength=num_strata)
+        return {
+            stratum: [int(counts[i]), float(weight_sums[i]), float(weight_tp_sums[i])]
+            for i, stratum in enumerate(self.strata)
+        }
+
+    def clone_type_summary(self, matched_benchmark_seqs):
+        """Эталонные пары и TP по типам клонов (как evaluate_clones.summarize_clone_types) или None, если разметки нет."""
+        if not self.meta['has_clone_types']:
+            return None
+        clone_types = self.pairs['clone_type'].astype(np.int64)
+        matched = np.isin(self.pairs['seq'], np.fromiter(matched_benchmark_seqs, dtype=np.int64, count=len(matched_benchmark_seqs)))
+        counts = np.bincount(clone_types, minlength=5)
+        tp_counts = np.bincount(clone_types[matched], minlength=5)
+        return {
+            clone_type_label(clone_type if clone_type else ''): [int(counts[clone_type]), int(tp_counts[clone_type])]
+            for clone_type in range(len(counts)) if counts[clone_type]
+        }
+
+def load_benchmark_index(benchmark_csv, rebuild=False):
+    """Загружает индекс эталона, при отсутствии или устаревании пересобирает его."""
+    index_dir = get_index_dir(benchmark_csv)
+    content_hash = None
+    if not rebuild:
+        fresh, content_hash = check_index_freshness(benchmark_csv, index_dir)
+        if fresh:
+            return BenchmarkIndex(index_dir)
+        if os.path.exists(index_dir):
+            print(f"Индекс эталона устарел, пересборка: {index_dir}")
+    build_benchmark_index(benchmark_csv, index_dir, content_hash)
+    return BenchmarkIndex(index_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка (или проверка) постоянного индекса эталонного бенчмарка для evaluate_clones.py.")
+    parser.add_argument("--benchmark_csv", type=str, required=True, help="Путь к CSV файлу эталонного бенчмарка (например, clones_2017.csv).")
+    parser.add_argument("--rebuild", action="store_true", help="Пересобрать индекс, даже если он актуален.")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.benchmark_csv):
+        print(f"Ошибка: Файл эталонного бенчмарка не найден: {args.benchmark_csv}")
+        return
+
+    started = time.perf_counter()
+    index = load_benchmark_index(args.benchmark_csv, rebuild=args.rebuild)
+    print(f"Индекс: {index.index_dir}")
+    print(f"Эталонных пар: {index.total}, пар файлов: {len(index)}, файлов: {len(index.paths)}, задач: {len(index.tasks)}")
+    print(f"Готово за {time.perf_counter() - started:.2f} с")
+
+if __name__ == '__main__':
+    main()
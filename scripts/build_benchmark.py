@@ -2,8 +2,17 @@ import pandas as pd
 import argparse
 import os
 import csv
+import math
+import random
+import zlib
+from bisect import bisect_left, bisect_right
+import numpy as np
 from tqdm import tqdm
 
+from fingerprints import mix64, ngram_profile
+from generate_pseudo_real_detector_output import get_normalized_lines
+from token_cache import DEFAULT_CACHE_DIR, TokenCache
+
 # Определение языка по расширению файла (упрощенно)
 LANGUAGE_EXTENSIONS = {
     '.py': 'Python',
@@ -13,10 +22,372 @@ LANGUAGE_EXTENSIONS = {
 # Директория для распакованных CSV файлов (относительно корня проекта)
 GCJ_UNPACKED_ROOT_SUBDIR = "data/gcj_csv_unpacked"
 
+# Поиск трудных отрицательных пар: MinHash-сигнатуры отпечатков решений и LSH по полосам сигнатуры.
+# 20 полос по 3 значения: пара с Jaccard 0.5 становится кандидатом с вероятностью ~0.93, с Jaccard 0.2 - ~0.15
+LSH_BANDS = 20
+LSH_ROWS = 3
+MINHASH_PERMUTATIONS = LSH_BANDS * LSH_ROWS
+# Длина n-грамм нормализованных токенов для отпечатков 'tokens' (как в label_clone_types.py)
+NEGATIVE_NGRAM = 4
+
 def get_language_from_filename(filename):
     _, ext = os.path.splitext(filename)
     return LANGUAGE_EXTENSIONS.get(ext.lower())
 
+def compute_size_strata_bounds(line_counts, num_strata):
+    """
+    Вычисляет границы страт по размеру решения (квантили количества строк по всем решениям года).
+    Возвращает отсортированный список верхних границ (для bisect), длиной не более num_strata - 1.
+    """
+    if num_strata <= 1 or not line_counts:
+        return []
+    sorted_counts = sorted(line_counts)
+    bounds = set()
+    for k in range(1, num_strata):
+        bounds.add(sorted_counts[(k * len(sorted_counts)) // num_strata - 1])
+    return sorted(bounds)
+
+def get_size_stratum(num_lines, strata_bounds):
+    """Номер страты по размеру решения."""
+    return bisect_left(strata_bounds, num_lines) if strata_bounds else 0
+
+def unrank_pair(index, n_first, n_second=None):
+    """
+    Восстанавливает пару позиций по номеру в неявном пространстве пар без его материализации.
+    n_second=None: пары (i, j), i < j, внутри одной группы из n_first элементов (порядок по j, затем по i).
+    Иначе: пары (i, j) между двумя группами размеров n_first и n_second.
+    """
+    if n_second is not None:
+        return index // n_second, index % n_second
+    j = (1 + math.isqrt(1 + 8 * index)) // 2
+    while j * (j - 1) // 2 > index:
+        j -= 1
+    while (j + 1) * j // 2 <= index:
+        j += 1
+    return index - j * (j - 1) // 2, j
+
+def _random_open_unit(rng):
+    """Случайное число из интервала (0, 1)."""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+def reservoir_sample_indices(population, k, rng):
+    """
+    Резервуарная выборка k номеров из потока 0..population-1 (алгоритм L, Li 1994).
+    Поток не перебирается поэлементно: пропуски между заменами генерируются геометрически,
+    поэтому сложность O(k * (1 + log(population / k))). Возвращает отсортированный список номеров.
+    """
+    if k >= population:
+        return list(range(population))
+    if k <= 0:
+        return []
+    reservoir = list(range(k))
+    w = math.exp(math.log(_random_open_unit(rng)) / k)
+    i = k - 1
+    while True:
+        i += math.floor(math.log(_random_open_unit(rng)) / math.log1p(-w)) + 1
+        if i >= population:
+            break
+        reservoir[rng.randrange(k)] = i
+        w *= math.exp(math.log(_random_open_unit(rng)) / k)
+    return sorted(reservoir)
+
+def allocate_quota(populations, cap):
+    """
+    Распределяет лимит пар задачи между стратами пропорционально их размеру (метод наибольшего остатка).
+    Если лимит позволяет, каждая непустая страта получает хотя бы одну пару, чтобы веса покрывали
+    все пространство пар. Квота страты не превышает ее размер.
+    """
+    if sum(populations) <= cap:
+        return list(populations)
+    nonempty = sum(1 for p in populations if p > 0)
+    quotas = [1 if p > 0 else 0 for p in populations] if cap >= nonempty else [0] * len(populations)
+    rest = [p - q for p, q in zip(populations, quotas)]
+    rest_cap = cap - sum(quotas)
+    rest_total = sum(rest)
+    exact = [r * rest_cap / rest_total for r in rest]
+    quotas = [q + min(r, math.floor(e)) for q, r, e in zip(quotas, rest, exact)]
+    remaining = cap - sum(quotas)
+    by_remainder = sorted(range(len(populations)), key=lambda i: (-(exact[i] - math.floor(exact[i])), i))
+    while remaining > 0:
+        for i in by_remainder:
+            if remaining == 0:
+                break
+            if quotas[i] < populations[i]:
+                quotas[i] += 1
+                remaining -= 1
+    return quotas
+
+def sample_task_pairs(task_id, solutions, max_pairs, strata_bounds, seed):
+    """
+    Стратифицированная детерминированная выборка пар одной задачи.
+    Решения группируются по стратам размера, пары страт (a <= b) образуют страты пар,
+    лимит задачи делится между ними пропорционально, внутри страты пары выбираются
+    резервуарной выборкой по неявному пространству пар. Вес пары = размер страты / размер выборки.
+    Если лимит меньше числа непустых страт пар, задача выбирается без стратификации (страта 'all'),
+    чтобы веса по-прежнему суммировались в число пар задачи.
+    """
+    solutions = sorted(solutions, key=lambda s: s['path'])
+    by_stratum = {}
+    for solution in solutions:
+        by_stratum.setdefault(get_size_stratum(solution['lines'], strata_bounds), []).append(solution)
+
+    strata_ids = sorted(by_stratum)
+    pair_strata = []
+    for a_pos, a in enumerate(strata_ids):
+        for b in strata_ids[a_pos:]:
+            n_a, n_b = len(by_stratum[a]), len(by_stratum[b])
+            population = n_a * (n_a - 1) // 2 if a == b else n_a * n_b
+            if population > 0:
+                pair_strata.append((a, b, population))
+
+    sampled = []
+
+    def pair_row(s1, s2, size_stratum, weight):
+        return {
+            'file1_path': s1['path'],
+            'file1_start': 0,
+            'file1_end': s1['lines'] - 1 if s1['lines'] > 0 else 0,
+            'file2_path': s2['path'],
+            'file2_start': 0,
+            'file2_end': s2['lines'] - 1 if s2['lines'] > 0 else 0,
+            'task_id': task_id,
+            'size_stratum': size_stratum,
+            'weight': weight
+        }
+
+    task_population = sum(p for _, _, p in pair_strata)
+    if max_pairs < len(pair_strata) and max_pairs < task_population:
+        # Лимит меньше числа непустых страт: часть страт получила бы нулевую квоту, и веса не покрыли бы
+        # все пары задачи. Пары выбираются из задачи целиком одной стратой 'all'.
+        rng = random.Random(f"{seed}:{task_id}:all")
+        weight = task_population / max_pairs
+        for index in reservoir_sample_indices(task_population, max_pairs, rng):
+            i, j = unrank_pair(index, len(solutions))
+            sampled.append(pair_row(solutions[i], solutions[j], 'all', weight))
+        return sampled
+
+    quotas = allocate_quota([p for _, _, p in pair_strata], max_pairs)
+    for (a, b, population), quota in zip(pair_strata, quotas):
+        if quota == 0:
+            continue
+        # Отдельный генератор на страту: результат не зависит от порядка обработки задач
+        rng = random.Random(f"{seed}:{task_id}:{a}:{b}")
+        weight = population / quota
+        for index in reservoir_sample_indices(population, quota, rng):
+            if a == b:
+                i, j = unrank_pair(index, len(by_stratum[a]))
+                s1, s2 = by_stratum[a][i], by_stratum[a][j]
+            else:
+                i, j = unrank_pair(index, len(by_stratum[a]), len(by_stratum[b]))
+                s1, s2 = by_stratum[a][i], by_stratum[b][j]
+            sampled.append(pair_row(s1, s2, f"{a}-{b}", weight))
+    return sampled
+
+class CrossTaskPairSpace:
+    """
+    Неявное пространство межзадачных пар решений. Решения упорядочены по задачам (task_sizes - размеры задач
+    в этом порядке), пара (i, j), i < j, из разных задач получает номер: сначала по задаче i, затем по i, затем по j.
+    Номер и пара переводятся друг в друга за O(log числа задач) без перебора квадратичного пространства.
+    """
+
+    def __init__(self, task_sizes):
+        self.offsets = [0]
+        for size in task_sizes:
+            self.offsets.append(self.offsets[-1] + size)
+        total = self.offsets[-1]
+        # Блок задачи a: ее решения в паре со всеми решениями следующих задач
+        self.tails = [total - self.offsets[a + 1] for a in range(len(task_sizes))]
+        self.block_starts = [0]
+        for size, tail in zip(task_sizes, self.tails):
+            self.block_starts.append(self.block_starts[-1] + size * tail)
+        self.size = self.block_starts[-1]
+
+    def unrank(self, index):
+        """Пара позиций (i, j) решений по номеру пары."""
+        a = bisect_right(self.block_starts, index) - 1
+        local = index - self.block_starts[a]
+        return self.offsets[a] + local // self.tails[a], self.offsets[a + 1] + local % self.tails[a]
+
+    def rank(self, first, second, first_task):
+        """Номера пар для массивов позиций first < second и номеров задач first (векторно)."""
+        offsets = np.array(self.offsets, dtype=np.int64)
+        tails = np.array(self.tails, dtype=np.int64)
+        block_starts = np.array(self.block_starts, dtype=np.int64)
+        return (block_starts[first_task] + (first - offsets[first_task]) * tails[first_task]
+                + (second - offsets[first_task + 1]))
+
+def sample_excluding(population, excluded, k, rng):
+    """
+    Выборка k номеров без возвращения из 0..population-1 за вычетом excluded (отсортированный массив без повторов).
+    Выбираются k рангов в дополнении (reservoir_sample_indices), ранг r переводится в номер
+    r + #{m: excluded[m] - m <= r}. Возвращает отсортированный массив номеров.
+    """
+    ranks = np.array(reservoir_sample_indices(population - len(excluded), k, rng), dtype=np.int64)
+    shifted = excluded - np.arange(len(excluded), dtype=np.int64)
+    return ranks + np.searchsorted(shifted, ranks, 'right')
+
+def solution_fingerprints(file_path, fingerprint_kind, token_cache):
+    """
+    Отпечатки решения: отсортированные уникальные хеши (uint64) n-грамм нормализованных токенов ('tokens')
+    или нормализованных строк ('lines', как в generate_pseudo_real_detector_output.py).
+    Возвращает None, если файл не удалось прочитать или разобрать или он пуст.
+    """
+    if fingerprint_kind == 'tokens':
+        stream = token_cache.get(file_path)
+        if stream is None:
+            return None
+        fingerprints = ngram_profile(stream.normalized, NEGATIVE_NGRAM)[0]
+    else:
+        lines = get_normalized_lines(file_path)
+        if lines is None:
+            return None
+        fingerprints = np.unique(np.fromiter(
+            (zlib.crc32(line.encode('utf-8', 'surrogatepass')) for line in lines), dtype=np.uint64, count=len(lines)
+        ))
+    return fingerprints if len(fingerprints) else None
+
+def fingerprint_similarity(fingerprints_1, fingerprints_2):
+    """Коэффициент Жаккара двух множеств отпечатков (отсортированных массивов без повторов)."""
+    if fingerprints_1 is None or fingerprints_2 is None:
+        return 0.0
+    idx = np.searchsorted(fingerprints_2, fingerprints_1).clip(max=len(fingerprints_2) - 1)
+    common = int(np.count_nonzero(fingerprints_2[idx] == fingerprints_1))
+    return common / (len(fingerprints_1) + len(fingerprints_2) - common)
+
+def minhash_signature(fingerprints, salts):
+    """MinHash-сигнатура множества отпечатков: минимум перемешанных хешей для каждой соли."""
+    return mix64(fingerprints[np.newaxis, :] ^ salts[:, np.newaxis]).min(axis=1)
+
+def lsh_candidate_pairs(signatures, groups, bucket_neighbors, rng):
+    """
+    Кандидаты в похожие пары по LSH: пары строк signatures, совпадающие хотя бы в одной полосе сигнатуры
+    и относящиеся к разным группам (задачам). Внутри корзины строки перемешиваются, и каждая образует пары
+    только со следующими bucket_neighbors строками, поэтому даже для огромных корзин (общий шаблон решения)
+    кандидатов не больше len(signatures) * LSH_BANDS * bucket_neighbors.
+    Возвращает отсортированные уникальные коды пар i * len(signatures) + j (i < j).
+    """
+    n = len(signatures)
+    codes = []
+    for band in range(LSH_BANDS):
+        columns = signatures[:, band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        keys = mix64(columns[:, 0] ^ np.uint64(band))
+        for c in range(1, LSH_ROWS):
+            keys = mix64(keys ^ columns[:, c])
+        order = np.lexsort((rng.random(n), keys))
+        sorted_keys = keys[order]
+        for offset in range(1, bucket_neighbors + 1):
+            same = sorted_keys[offset:] == sorted_keys[:-offset]
+            if not same.any():
+                break # Корзин размером больше offset нет
+            first = order[:-offset][same]
+            second = order[offset:][same]
+            cross = groups[first] != groups[second]
+            first, second = first[cross], second[cross]
+            codes.append(np.minimum(first, second).astype(np.uint64) * np.uint64(n) + np.maximum(first, second).astype(np.uint64))
+    if not codes:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(codes))
+
+def find_hard_negative_pool(fingerprints, task_of, min_similarity, bucket_neighbors, seed):
+    """
+    Трудные отрицательные пары: межзадачные пары с коэффициентом Жаккара отпечатков >= min_similarity,
+    найденные индексом MinHash-LSH. Сходство кандидатов пересчитывается точно.
+    Возвращает: (позиции first, позиции second (first < second), сходства, число кандидатов LSH)
+    """
+    indexed = np.array([i for i, f in enumerate(fingerprints) if f is not None], dtype=np.int64)
+    empty = np.empty(0, dtype=np.int64)
+    if len(indexed) < 2:
+        return empty, empty, np.empty(0), 0
+    rng = np.random.default_rng(seed)
+    salts = np.frombuffer(rng.bytes(8 * MINHASH_PERMUTATIONS), dtype='<u8').astype(np.uint64)
+    signatures = np.stack([minhash_signature(fingerprints[i], salts) for i in tqdm(indexed, desc="MinHash-сигнатуры")])
+    codes = lsh_candidate_pairs(signatures, task_of[indexed], bucket_neighbors, rng)
+
+    n = np.uint64(len(indexed))
+    first = indexed[(codes // n).astype(np.int64)]
+    second = indexed[(codes % n).astype(np.int64)]
+    similarities = np.array([fingerprint_similarity(fingerprints[i], fingerprints[j]) for i, j in zip(first, second)])
+    keep = similarities >= min_similarity
+    return first[keep], second[keep], similarities[keep], len(codes)
+
+def build_negative_pairs(python_solutions_by_task, project_root, num_negatives, hard_fraction, min_similarity,
+                         fingerprint_kind, bucket_neighbors, cache_dir, seed):
+    """
+    Детерминированная выборка отрицательных (межзадачных) пар без возвращения.
+    Пространство межзадачных пар делится на две непересекающиеся страты: 'hard' - пары, найденные индексом
+    сходства (find_hard_negative_pool), и 'random' - все остальные. Трудным парам отводится доля hard_fraction
+    выборки (сверх их доли в пространстве); недобор отдается случайным. Вес пары = размер страты / размер выборки,
+    поэтому взвешенная доля помеченных детектором пар оценивает FPR по всему межзадачному пространству.
+    Возвращает: (список строк CSV, статистика)
+    """
+    tasks = sorted(python_solutions_by_task)
+    solutions = []
+    task_of = []
+    for task_pos, task_id in enumerate(tasks):
+        for solution in sorted(python_solutions_by_task[task_id], key=lambda s: s['path']):
+            solutions.append(solution)
+            task_of.append(task_pos)
+    task_of = np.array(task_of, dtype=np.int64)
+    space = CrossTaskPairSpace([len(python_solutions_by_task[task_id]) for task_id in tasks])
+    stats = {'space': space.size, 'indexed': 0, 'candidates': 0, 'hard_pool': 0}
+    if space.size == 0:
+        return [], stats
+
+    token_cache = TokenCache(cache_dir)
+    fingerprints = [solution_fingerprints(os.path.join(project_root, s['path']), fingerprint_kind, token_cache)
+                    for s in tqdm(solutions, desc="Отпечатки решений")]
+    stats['indexed'] = sum(1 for f in fingerprints if f is not None)
+
+    hard_quota = min(num_negatives, round(num_negatives * hard_fraction))
+    empty = np.empty(0, dtype=np.int64)
+    hard_first, hard_second, hard_similarities = empty, empty, np.empty(0)
+    if hard_quota > 0:
+        hard_first, hard_second, hard_similarities, stats['candidates'] = find_hard_negative_pool(
+            fingerprints, task_of, min_similarity, bucket_neighbors, seed
+        )
+    hard_ranks = space.rank(hard_first, hard_second, task_of[hard_first])
+    order = np.argsort(hard_ranks)
+    hard_ranks, hard_first, hard_second, hard_similarities = (
+        hard_ranks[order], hard_first[order], hard_second[order], hard_similarities[order]
+    )
+    stats['hard_pool'] = len(hard_ranks)
+
+    def negative_row(i, j, negative_type, similarity, weight):
+        s1, s2 = solutions[i], solutions[j]
+        return {
+            'file1_path': s1['path'],
+            'file1_start': 0,
+            'file1_end': s1['lines'] - 1 if s1['lines'] > 0 else 0,
+            'file2_path': s2['path'],
+            'file2_start': 0,
+            'file2_end': s2['lines'] - 1 if s2['lines'] > 0 else 0,
+            'task1_id': tasks[task_of[i]],
+            'task2_id': tasks[task_of[j]],
+            'negative_type': negative_type,
+            'similarity': round(float(similarity), 4),
+            'weight': weight
+        }
+
+    rows = []
+    hard_quota = min(hard_quota, len(hard_ranks))
+    if hard_quota > 0:
+        weight = len(hard_ranks) / hard_quota
+        for k in reservoir_sample_indices(len(hard_ranks), hard_quota, random.Random(f"{seed}:negatives:hard")):
+            rows.append(negative_row(int(hard_first[k]), int(hard_second[k]), 'hard', hard_similarities[k], weight))
+
+    random_population = space.size - len(hard_ranks)
+    random_quota = min(num_negatives - hard_quota, random_population)
+    if random_quota > 0:
+        weight = random_population / random_quota
+        rng = random.Random(f"{seed}:negatives:random")
+        for index in sample_excluding(space.size, hard_ranks, random_quota, rng):
+            i, j = space.unrank(int(index))
+            rows.append(negative_row(i, j, 'random', fingerprint_similarity(fingerprints[i], fingerprints[j]), weight))
+    return rows, stats
+
 def main():
     parser = argparse.ArgumentParser(description="Скрипт для сборки бенчмарка Python-клонов из данных Google Code Jam.")
     parser.add_argument("--year", required=True, help="Год для обработки (например, 2017).")
@@ -33,9 +404,46 @@ def main():
         "Директория для сохранения итоговых CSV файлов с парами клонов (например, 'benchmark_output'). "
         "Будет создана относительно корня проекта, если не существует."
     ))
+    parser.add_argument("--max_pairs_per_task", type=int, default=None, help=(
+        "Если указан, вместо полного бенчмарка создается выборочный (clones_ГОД_sampled.csv) "
+        "с не более чем указанным количеством пар на задачу."
+    ))
+    parser.add_argument("--size_strata", type=int, default=3, help="Количество страт по размеру решения для выборочного бенчмарка (по умолчанию 3).")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора для выборочного бенчмарка и отрицательных пар (по умолчанию 42).")
+    parser.add_argument("--num_negatives", type=int, default=None, help=(
+        "Если указан, дополнительно создается набор отрицательных пар negatives_ГОД.csv: указанное количество пар "
+        "решений разных задач, выбранных без возвращения (для оценки специфичности в evaluate_clones.py --negatives_csv)."
+    ))
+    parser.add_argument("--hard_negative_fraction", type=float, default=0.5, help=(
+        "Доля трудных отрицательных пар (межзадачных пар с высоким сходством отпечатков) в наборе (по умолчанию 0.5)."
+    ))
+    parser.add_argument("--hard_negative_similarity", type=float, default=0.5, help=(
+        "Минимальный коэффициент Жаккара отпечатков для трудной отрицательной пары (по умолчанию 0.5)."
+    ))
+    parser.add_argument("--hard_negative_fingerprint", choices=['tokens', 'lines'], default='tokens', help=(
+        "Отпечатки для поиска трудных пар: n-граммы нормализованных токенов (tokens, по умолчанию) "
+        "или нормализованные строки (lines)."
+    ))
+    parser.add_argument("--lsh_bucket_neighbors", type=int, default=32, help=(
+        "Сколько соседей в корзине LSH проверяется для каждого решения (ограничивает число кандидатов, по умолчанию 32)."
+    ))
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Директория кэша токенов (по умолчанию data/token_cache).")
     
     args = parser.parse_args()
 
+    if args.max_pairs_per_task is not None and args.max_pairs_per_task < 1:
+        print("Ошибка: --max_pairs_per_task должен быть не меньше 1.")
+        return
+    if args.num_negatives is not None and args.num_negatives < 1:
+        print("Ошибка: --num_negatives должен быть не меньше 1.")
+        return
+    if not 0 <= args.hard_negative_fraction <= 1:
+        print("Ошибка: --hard_negative_fraction должна быть в диапазоне [0, 1].")
+        return
+    if not 0 <= args.hard_negative_similarity <= 1:
+        print("Ошибка: --hard_negative_similarity должен быть в диапазоне [0, 1].")
+        return
+
     # Определяем корень проекта (директория, содержащая директорию scripts)
     scripts_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.abspath(os.path.join(scripts_dir, '..'))
@@ -65,7 +473,10 @@ def main():
     os.makedirs(benchmark_output_abs_dir, exist_ok=True)
 
     # Путь к итоговому файлу с парами клонов
-    output_clones_csv = os.path.join(benchmark_output_abs_dir, f"clones_{args.year}.csv")
+    if args.max_pairs_per_task is not None:
+        output_clones_csv = os.path.join(benchmark_output_abs_dir, f"clones_{args.year}_sampled.csv")
+    else:
+        output_clones_csv = os.path.join(benchmark_output_abs_dir, f"clones_{args.year}.csv")
 
     solutions_data = [] # Для хранения информации о извлеченных решениях
     python_solutions_by_task = {} # Для группировки Python-решений по задачам
@@ -137,22 +548,33 @@ def main():
         return
 
     clone_pairs = []
-    print("Генерация пар клонов...")
-    for task_id, solutions in tqdm(python_solutions_by_task.items(), desc="Генерация пар"):
-        if len(solutions) > 1: 
-            for i in range(len(solutions)):
-                for j in range(i + 1, len(solutions)):
-                    s1 = solutions[i]
-                    s2 = solutions[j]
-                    clone_pairs.append({
-                        'file1_path': s1['path'],
-                        'file1_start': 0,
-                        'file1_end': s1['lines'] - 1 if s1['lines'] > 0 else 0,
-                        'file2_path': s2['path'],
-                        'file2_start': 0,
-                        'file2_end': s2['lines'] - 1 if s2['lines'] > 0 else 0,
-                        'task_id': task_id
-                    })
+    if args.max_pairs_per_task is not None:
+        strata_bounds = compute_size_strata_bounds([s['num_lines'] for s in solutions_data], args.size_strata)
+        print(f"Генерация выборочного бенчмарка: не более {args.max_pairs_per_task} пар на задачу, "
+              f"границы страт по строкам: {strata_bounds}, seed={args.seed}")
+        num_pair_strata = (len(strata_bounds) + 1) * (len(strata_bounds) + 2) // 2
+        if args.max_pairs_per_task < num_pair_strata:
+            print(f"Предупреждение: лимит {args.max_pairs_per_task} меньше числа страт пар ({num_pair_strata}); "
+                  f"задачи, где он меньше числа непустых страт, выбираются без стратификации (страта 'all').")
+        for task_id, solutions in tqdm(sorted(python_solutions_by_task.items()), desc="Выборка пар"):
+            clone_pairs.extend(sample_task_pairs(task_id, solutions, args.max_pairs_per_task, strata_bounds, args.seed))
+    else:
+        print("Генерация пар клонов...")
+        for task_id, solutions in tqdm(python_solutions_by_task.items(), desc="Генерация пар"):
+            if len(solutions) > 1: 
+                for i in range(len(solutions)):
+                    for j in range(i + 1, len(solutions)):
+                        s1 = solutions[i]
+                        s2 = solutions[j]
+                        clone_pairs.append({
+                            'file1_path': s1['path'],
+                            'file1_start': 0,
+                            'file1_end': s1['lines'] - 1 if s1['lines'] > 0 else 0,
+                            'file2_path': s2['path'],
+                            'file2_start': 0,
+                            'file2_end': s2['lines'] - 1 if s2['lines'] > 0 else 0,
+                            'task_id': task_id
+                        })
     
     clones_df = pd.DataFrame(clone_pairs)
     try:
@@ -163,5 +585,25 @@ def main():
     except Exception as e:
         print(f"Ошибка при сохранении CSV файла с парами клонов {output_clones_csv}: {e}")
 
+    if args.num_negatives:
+        output_negatives_csv = os.path.join(benchmark_output_abs_dir, f"negatives_{args.year}.csv")
+        print(f"Генерация отрицательных пар: {args.num_negatives} (доля трудных {args.hard_negative_fraction}, "
+              f"отпечатки {args.hard_negative_fingerprint}, порог сходства {args.hard_negative_similarity}), seed={args.seed}")
+        negative_pairs, stats = build_negative_pairs(
+            python_solutions_by_task, project_root, args.num_negatives, args.hard_negative_fraction,
+            args.hard_negative_similarity, args.hard_negative_fingerprint, args.lsh_bucket_neighbors, args.cache_dir, args.seed
+        )
+        print(f"Межзадачных пар в пространстве: {stats['space']}, решений с отпечатками: {stats['indexed']}, "
+              f"кандидатов LSH: {stats['candidates']}, трудных пар найдено: {stats['hard_pool']}")
+        negatives_df = pd.DataFrame(negative_pairs)
+        try:
+            negatives_df.to_csv(output_negatives_csv, index=False)
+            print(f"Отрицательные пары сохранены: {output_negatives_csv}")
+            if len(negatives_df):
+                print(f"Всего отрицательных пар: {len(negatives_df)} "
+                      f"(трудных: {int((negatives_df['negative_type'] == 'hard').sum())})")
+        except Exception as e:
+            print(f"Ошибка при сохранении CSV файла с отрицательными парами {output_negatives_csv}: {e}")
+
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -0,0 +1,335 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark_index import BenchmarkIndex
+from evaluate_clones import (
+    COORD_COLUMNS,
+    evaluate_tool_rows,
+    extract_task_id_from_path,
+    load_benchmark,
+    resolve_tool_path,
+)
+from fingerprints import mix64
+
+# Количество строк, читаемых из БД за один раз
+READ_CHUNK_ROWS = 1000000
+RESULT_COLUMNS = ['file1_path', 'file1_start', 'file1_end', 'file2_path', 'file2_start', 'file2_end']
+# Метки задач для пар файлов из разных задач и для путей вне extracted_solutions/ГОД/TASK_ID/
+CROSS_TASK_LABEL = '(разные задачи)'
+UNKNOWN_TASK_LABEL = '(без задачи)'
+
+def pair_keys(f1, s1, e1, f2, s2, e2):
+    """
+    64-битные ключи пар: пара приводится к каноническому виду (файл с меньшим номером первым,
+    координаты переставляются вместе с файлами), и номера файлов с координатами хешируются.
+    Вероятность коллизии для 10^8 пар порядка 10^-4.
+    """
+    swap = f1 > f2
+    fields = [
+        np.minimum(f1, f2), np.maximum(f1, f2),
+        np.where(swap, s2, s1), np.where(swap, e2, e1),
+        np.where(swap, s1, s2), np.where(swap, e1, e2),
+    ]
+    key = np.zeros(len(f1), dtype=np.uint64)
+    for field in fields:
+        key = mix64(key ^ field.astype(np.int64).view(np.uint64))
+    return key
+
+def intern_paths(values, path_ids, paths):
+    """
+    Номера путей в таблице путей прогона. Каждый уникальный путь порции
+    разрешается (resolve_tool_path) и ищется в словаре один раз, остальное - векторно.
+    """
+    codes, uniques = pd.factorize(np.array(values, dtype=object))
+    ids = np.empty(len(uniques), dtype=np.int64)
+    for i, path in enumerate(uniques):
+        resolved = resolve_tool_path(path)
+        path_id = path_ids.get(resolved)
+        if path_id is None:
+            path_id = path_ids[resolved] = len(paths)
+            paths.append(resolved)
+        ids[i] = path_id
+    return ids[codes]
+
+def read_run(db_file, table_name, chunk_rows=READ_CHUNK_ROWS):
+    """
+    Читает прогон детектора из таблицы БД в порядке строк (rowid, как evaluate_clones.iter_detector_db_rows).
+    Построчная выборка через курсор sqlite3 слишком медленна для десятков миллионов строк, поэтому каждая
+    порция rowid собирается самой SQLite в строки через group_concat (пути через перевод строки, координаты
+    через запятую) и разбирается векторно (str.split, pd.factorize, np.fromstring).
+    Возвращает словарь: paths (список разрешенных путей), f1, s1, e1, f2, s2, e2 (номера путей и координаты).
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        first_rowid, last_rowid = conn.execute(f"SELECT min(rowid), max(rowid) FROM {table_name}").fetchone()
+        path_ids = {}
+        paths = []
+        parts = {name: [] for name in ('f1', 'f2', 'coords')}
+        for start in range(first_rowid or 0, (last_rowid or -1) + 1, chunk_rows):
+            paths_1, paths_2, *coord_columns, count = conn.execute(
+                f"SELECT group_concat(file1_path, char(10)), group_concat(file2_path, char(10)), "
+                f"{', '.join(f'group_concat(CAST({col} AS INTEGER))' for col in COORD_COLUMNS)}, count(*) "
+                f"FROM (SELECT * FROM {table_name} WHERE rowid >= ? AND rowid < ? ORDER BY rowid)",
+                (start, start + chunk_rows)
+            ).fetchone()
+            if not count:
+                continue
+            f1 = intern_paths(paths_1.split('\n'), path_ids, paths)
+            f2 = intern_paths(paths_2.split('\n'), path_ids, paths)
+            coords = np.stack([np.fromstring(column or '', dtype=np.int64, sep=',') for column in coord_columns], axis=1) \
+                if all(column and column.count(',') + 1 == count for column in coord_columns) else None
+            if coords is None or not (len(f1) == len(f2) == count):
+                raise ValueError(f"В таблице {table_name} есть строки с пустыми путями или координатами.")
+            parts['f1'].append(f1)
+            parts['f2'].append(f2)
+            parts['coords'].append(coords)
+    finally:
+        conn.close()
+    coords = np.concatenate(parts['coords']) if parts['coords'] else np.empty((0, 4), dtype=np.int64)
+    run = {
+        'paths': paths,
+        'f1': np.concatenate(parts['f1']) if parts['f1'] else np.empty(0, dtype=np.int64),
+        'f2': np.concatenate(parts['f2']) if parts['f2'] else np.empty(0, dtype=np.int64),
+    }
+    for i, name in enumerate(('s1', 'e1', 's2', 'e2')):
+        run[name] = np.ascontiguousarray(coords[:, i])
+    return run
+
+def merge_run_paths(base, new):
+    """
+    Сводит таблицы путей двух прогонов в одну (номера путей базового прогона сохраняются)
+    и вычисляет ключи пар (pair_keys) обоих прогонов в общей нумерации. Возвращает общий список путей.
+    """
+    paths = list(base['paths'])
+    path_ids = {path: i for i, path in enumerate(paths)}
+    remap = np.empty(len(new['paths']), dtype=np.int64)
+    for i, path in enumerate(new['paths']):
+        path_id = path_ids.get(path)
+        if path_id is None:
+            path_id = path_ids[path] = len(paths)
+            paths.append(path)
+        remap[i] = path_id
+    new['f1'] = remap[new['f1']]
+    new['f2'] = remap[new['f2']]
+    for run in (base, new):
+        run['key'] = pair_keys(run['f1'], run['s1'], run['e1'], run['f2'], run['s2'], run['e2'])
+    return paths
+
+def unique_pairs(keys, row_flags=None):
+    """
+    Уникальные ключи прогона в отсортированном виде.
+    Возвращает: (отсортированные уникальные ключи, номер первой строки каждого ключа,
+    флаг для каждого ключа - есть ли среди его строк строка с row_flags, или None)
+    """
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    if len(keys):
+        starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    else:
+        starts = np.empty(0, dtype=np.int64)
+    flags = None
+    if row_flags is not None:
+        flags = np.maximum.reduceat(row_flags[order], starts) if len(keys) else np.empty(0, dtype=bool)
+    return sorted_keys[starts], order[starts], flags
+
+def sorted_membership(values, sorted_reference):
+    """Для каждого значения - есть ли оно в отсортированном массиве sorted_reference (бинарный поиск)."""
+    if len(sorted_reference) == 0:
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(sorted_reference, values).clip(max=len(sorted_reference) - 1)
+    return sorted_reference[idx] == values
+
+def benchmark_candidate_rows(benchmark, paths, run):
+    """
+    Номера строк прогона, пара файлов которых есть в эталоне: только они могут быть сопоставлены,
+    остальные строки - FP без сопоставления. Для индекса эталона проверка векторная (по keys индекса).
+    """
+    if isinstance(benchmark, BenchmarkIndex):
+        index_ids = np.array([benchmark.path_ids.get(path, -1) for path in paths], dtype=np.int64)
+        id_1 = index_ids[run['f1']]
+        id_2 = index_ids[run['f2']]
+        known = (id_1 >= 0) & (id_2 >= 0)
+        lo = np.minimum(id_1, id_2).astype(np.uint64)
+        hi = np.maximum(id_1, id_2).astype(np.uint64)
+        packed = (lo << np.uint64(32)) | hi
+        return np.flatnonzero(known & sorted_membership(packed, benchmark.keys))
+    file_pairs = np.unique(np.stack([np.minimum(run['f1'], run['f2']), np.maximum(run['f1'], run['f2'])], axis=1), axis=0)
+    present = {
+        (lo, hi) for lo, hi in file_pairs.tolist()
+        if (min(paths[lo], paths[hi]), max(paths[lo], paths[hi])) in benchmark
+    }
+    lo = np.minimum(run['f1'], run['f2']).tolist()
+    hi = np.maximum(run['f1'], run['f2']).tolist()
+    return np.array([i for i, pair in enumerate(zip(lo, hi)) if pair in present], dtype=np.int64)
+
+def evaluate_run(benchmark, paths, run, threshold):
+    """
+    Сопоставляет прогон с эталоном (как evaluate_clones.py, c-match).
+    Возвращает: (флаги TP по строкам прогона, множество номеров сопоставленных эталонных пар)
+    """
+    candidates = benchmark_candidate_rows(benchmark, paths, run)
+    columns = [run[name][candidates].tolist() for name in ('f1', 's1', 'e1', 'f2', 's2', 'e2')]
+    rows = (
+        (seq, paths[f1], s1, e1, paths[f2], s2, e2)
+        for seq, f1, s1, e1, f2, s2, e2 in zip(candidates.tolist(), *columns)
+    )
+    result = evaluate_tool_rows(benchmark, rows, threshold)
+    used = result['used_tool']['c-match']
+    tp_flags = np.zeros(len(run['key']), dtype=bool)
+    tp_flags[np.fromiter(used, dtype=np.int64, count=len(used))] = True
+    return tp_flags, result['matched_benchmark']['c-match']
+
+def path_task_codes(paths):
+    """
+    Коды задач путей (task_id из пути) для разбивки по задачам.
+    Возвращает: (коды задач по номерам путей, список названий задач; последнее - CROSS_TASK_LABEL)
+    """
+    codes, task_names = pd.factorize(pd.Series([extract_task_id_from_path(path) or UNKNOWN_TASK_LABEL for path in paths], dtype=object))
+    return codes, list(task_names) + [CROSS_TASK_LABEL]
+
+def pair_task_codes(task_codes, task_names, f1, f2):
+    """Задачи пар: задача файлов, если оба файла из одной задачи, иначе CROSS_TASK_LABEL."""
+    codes_1 = task_codes[f1]
+    codes_2 = task_codes[f2]
+    return np.where(codes_1 == codes_2, codes_1, len(task_names) - 1)
+
+def export_pairs(output_csv, paths, run, rows, task_codes, task_names, tp_flags):
+    """Сохраняет пары прогона (по номерам строк rows) в CSV с задачей и статусом сопоставления с эталоном."""
+    df = pd.DataFrame({
+        'file1_path': np.array(paths, dtype=object)[run['f1'][rows]],
+        'file1_start': run['s1'][rows],
+        'file1_end': run['e1'][rows],
+        'file2_path': np.array(paths, dtype=object)[run['f2'][rows]],
+        'file2_start': run['s2'][rows],
+        'file2_end': run['e2'][rows],
+        'task_id': np.array(task_names, dtype=object)[task_codes],
+    })
+    if tp_flags is not None:
+        df['benchmark_match'] = np.where(tp_flags, 'TP', 'FP')
+    df.to_csv(output_csv, index=False)
+
+def print_task_breakdown(gained_tasks, lost_tasks, task_names, gained_tp, lost_tp, top_tasks):
+    """Выводит задачи с наибольшим числом изменившихся пар."""
+    num_tasks = len(task_names)
+    gained = np.bincount(gained_tasks, minlength=num_tasks)
+    lost = np.bincount(lost_tasks, minlength=num_tasks)
+    has_status = gained_tp is not None
+    if has_status:
+        gained_tp_counts = np.bincount(gained_tasks[gained_tp], minlength=num_tasks)
+        lost_tp_counts = np.bincount(lost_tasks[lost_tp], minlength=num_tasks)
+    changed = np.flatnonzero(gained + lost)
+    order = changed[np.lexsort((changed, -(gained[changed] + lost[changed])))][:top_tasks]
+    print(f"\n--- Изменения по задачам (первые {len(order)} из {len(changed)}) ---")
+    header = f"{'Задача':<24} {'Добавлено':>10} {'Потеряно':>10}"
+    if has_status:
+        header += f" {'Добавлено TP':>13} {'Потеряно TP':>12}"
+    print(header)
+    for t in order:
+        line = f"{task_names[t]:<24} {gained[t]:>10} {lost[t]:>10}"
+        if has_status:
+            line += f" {gained_tp_counts[t]:>13} {lost_tp_counts[t]:>12}"
+        print(line)
+    print("-------------------------")
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Сравнение двух прогонов детектора из БД результатов: какие пары добавил и потерял новый прогон, "
+        "с разбивкой по задачам и по сопоставлению с эталоном."
+    ))
+    parser.add_argument("--db_file", type=str, required=True, help="Путь к файлу БД SQLite с результатами базового прогона.")
+    parser.add_argument("--base_table", type=str, required=True, help="Таблица базового (старого) прогона.")
+    parser.add_argument("--new_table", type=str, required=True, help="Таблица нового прогона.")
+    parser.add_argument("--new_db_file", type=str, default=None, help="БД нового прогона, если она отличается от --db_file.")
+    parser.add_argument("--benchmark_csv", type=str, default=None, help=(
+        "Эталонный CSV (например, clones_2017.csv). Если указан, пары делятся на TP и FP (c-match) "
+        "и выводится, какие эталонные пары найдены только одним из прогонов."
+    ))
+    parser.add_argument("--threshold", type=float, default=0.7, help="Порог покрытия для c-match (по умолчанию 0.7).")
+    parser.add_argument("--no_index", action="store_true", help="Не использовать постоянный индекс эталона (clones_ГОД.csv.index/).")
+    parser.add_argument("--top_tasks", type=int, default=20, help="Сколько задач с наибольшими изменениями вывести (по умолчанию 20).")
+    parser.add_argument("--export_dir", type=str, default=None, help="Директория для gained_pairs.csv и lost_pairs.csv с добавленными и потерянными парами.")
+
+    args = parser.parse_args()
+
+    new_db_file = args.new_db_file or args.db_file
+    for db_file in (args.db_file, new_db_file):
+        if not os.path.exists(db_file):
+            print(f"Ошибка: Файл БД детектора не найден: {db_file}")
+            return
+    if args.benchmark_csv and not os.path.exists(args.benchmark_csv):
+        print(f"Ошибка: Файл эталонного бенчмарка не найден: {args.benchmark_csv}")
+        return
+
+    started = time.perf_counter()
+    try:
+        base = read_run(args.db_file, args.base_table)
+        new = read_run(new_db_file, args.new_table)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Ошибка при чтении прогонов из БД: {e}")
+        return
+    paths = merge_run_paths(base, new)
+    print(f"Прочитано строк: базовый {len(base['key'])}, новый {len(new['key'])}, файлов: {len(paths)} "
+          f"за {time.perf_counter() - started:.2f} с")
+
+    base_tp = new_tp = None
+    if args.benchmark_csv:
+        eval_started = time.perf_counter()
+        benchmark = load_benchmark(args.benchmark_csv, use_index=not args.no_index)
+        base_tp, base_matched = evaluate_run(benchmark, paths, base, args.threshold)
+        new_tp, new_matched = evaluate_run(benchmark, paths, new, args.threshold)
+        print(f"Сопоставление с эталоном ({benchmark.total} пар): {time.perf_counter() - eval_started:.2f} с")
+
+    base_keys, base_rows, base_key_tp = unique_pairs(base['key'], base_tp)
+    new_keys, new_rows, new_key_tp = unique_pairs(new['key'], new_tp)
+    lost_mask = ~sorted_membership(base_keys, new_keys)
+    gained_mask = ~sorted_membership(new_keys, base_keys)
+    common = len(new_keys) - int(gained_mask.sum())
+
+    print("\n--- Сравнение прогонов ---")
+    print(f"{'':<28} {'Базовый':>12} {'Новый':>12}")
+    print(f"{'Строк':<28} {len(base['key']):>12} {len(new['key']):>12}")
+    print(f"{'Уникальных пар':<28} {len(base_keys):>12} {len(new_keys):>12}")
+    print(f"{'Повторяющихся строк':<28} {len(base['key']) - len(base_keys):>12} {len(new['key']) - len(new_keys):>12}")
+    print(f"Общих пар:                   {common}")
+    print(f"Потеряно (только в базовом): {int(lost_mask.sum())}")
+    print(f"Добавлено (только в новом):  {int(gained_mask.sum())}")
+
+    gained_tp = lost_tp = None
+    if args.benchmark_csv:
+        gained_tp = new_key_tp[gained_mask]
+        lost_tp = base_key_tp[lost_mask]
+        common_new_tp = int(new_key_tp[~gained_mask].sum())
+        common_base_tp = int(base_key_tp[~lost_mask].sum())
+        print(f"\n--- По сопоставлению с эталоном (c-match, порог {args.threshold}) ---")
+        print(f"{'':<28} {'TP':>12} {'FP':>12}")
+        print(f"{'Добавленные пары':<28} {int(gained_tp.sum()):>12} {int((~gained_tp).sum()):>12}")
+        print(f"{'Потерянные пары':<28} {int(lost_tp.sum()):>12} {int((~lost_tp).sum()):>12}")
+        print(f"{'Общие пары (базовый)':<28} {common_base_tp:>12} {common - common_base_tp:>12}")
+        print(f"{'Общие пары (новый)':<28} {common_new_tp:>12} {common - common_new_tp:>12}")
+        print(f"Эталонных пар найдено: базовым {len(base_matched)}, новым {len(new_matched)} из {benchmark.total}")
+        print(f"  только новым: {len(new_matched - base_matched)}, только базовым: {len(base_matched - new_matched)}, "
+              f"обоими: {len(new_matched & base_matched)}")
+        print("-------------------------")
+
+    gained_rows = new_rows[gained_mask]
+    lost_rows = base_rows[lost_mask]
+    task_codes, task_names = path_task_codes(paths)
+    gained_tasks = pair_task_codes(task_codes, task_names, new['f1'][gained_rows], new['f2'][gained_rows])
+    lost_tasks = pair_task_codes(task_codes, task_names, base['f1'][lost_rows], base['f2'][lost_rows])
+    print_task_breakdown(gained_tasks, lost_tasks, task_names, gained_tp, lost_tp, args.top_tasks)
+
+    if args.export_dir:
+        os.makedirs(args.export_dir, exist_ok=True)
+        export_pairs(os.path.join(args.export_dir, 'gained_pairs.csv'), paths, new, gained_rows, gained_tasks, task_names, gained_tp)
+        export_pairs(os.path.join(args.export_dir, 'lost_pairs.csv'), paths, base, lost_rows, lost_tasks, task_names, lost_tp)
+        print(f"Добавленные и потерянные пары сохранены в {args.export_dir}")
+
+    print(f"Готово за {time.perf_counter() - started:.2f} с")
+
+if __name__ == '__main__':
+    main()
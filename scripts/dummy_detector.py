@@ -0,0 +1,51 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+from generate_pseudo_real_detector_output import get_normalized_lines
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Простой локальный детектор для проверки run_detector.py: сравнивает все пары .py файлов директории "
+        "по доле совпадающих нормализованных строк и записывает найденные клоны (файлы целиком) в CSV."
+    ))
+    parser.add_argument("--input_dir", required=True, help="Директория с решениями (например, extracted_solutions/2017/TASK_ID).")
+    parser.add_argument("--output_csv", required=True, help="Путь к выходному CSV файлу.")
+    parser.add_argument("--threshold", type=float, default=0.7, help="Порог совпадения строк (по умолчанию 0.7).")
+    parser.add_argument("--sleep", type=float, default=0.0, help="Задержка перед работой в секундах (для проверки таймаутов).")
+    parser.add_argument("--fail", action="store_true", help="Завершиться с ошибкой (для проверки повторных попыток).")
+
+    args = parser.parse_args()
+
+    if args.sleep:
+        time.sleep(args.sleep)
+    if args.fail:
+        print("Ошибка: запрошен аварийный выход (--fail).", file=sys.stderr)
+        sys.exit(1)
+
+    files = []
+    for root, _, names in os.walk(args.input_dir):
+        for name in names:
+            if name.endswith('.py'):
+                path = os.path.abspath(os.path.join(root, name))
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    # Последняя строка (с 0, включительно) считается так же, как file_end в build_benchmark.py
+                    last_line = f.read().count('\n')
+                files.append((path, get_normalized_lines(path) or set(), last_line))
+    files.sort()
+
+    with open(args.output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file1_path', 'file1_start', 'file1_end', 'file2_path', 'file2_start', 'file2_end'])
+        for i in range(len(files)):
+            path1, lines1, last1 = files[i]
+            for j in range(i + 1, len(files)):
+                path2, lines2, last2 = files[j]
+                union = lines1 | lines2
+                if union and len(lines1 & lines2) / len(union) >= args.threshold:
+                    writer.writerow([path1, 0, last1, path2, 0, last2])
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,37 @@
 import sqlite3
-import pandas as pd
 import argparse
 import os
 import pathlib
+import csv
+import glob
+import heapq
+import itertools
+import tempfile
+import json
+import time
+from bisect import bisect_right
+from functools import lru_cache
+
+# Директория скрипта: относительно нее разрешаются пути из эталонного CSV
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+
+# Колонки координат в CSV детектора и эталона
+COORD_COLUMNS = ['file1_start', 'file1_end', 'file2_start', 'file2_end']
+REQUIRED_TOOL_COLUMNS = ['file1_path', 'file1_start', 'file1_end', 'file2_path', 'file2_start', 'file2_end']
+
+# Параметры внешней сортировки (режим --tool_csv)
+# Приблизительный размер одной записи в памяти без учета строк путей (кортеж + int + str заголовки)
+SORT_RECORD_OVERHEAD_BYTES = 350
+# Размер порции чтения растущего CSV в режиме --follow (в символах)
+FOLLOW_READ_CHUNK_CHARS = 8 * 1024 * 1024
+# Максимальное количество прогонов, сливаемых за один проход heapq.merge
+MAX_MERGE_FAN_IN = 64
+# Минимальный размер буфера чтения одного прогона при слиянии
+MIN_RUN_BUFFER_BYTES = 64 * 1024
+
+# Варианты критериев сопоставления: c-match (Svajlenko & Roy, BigCloneBench),
+# ok-match и good-match (Bellon et al., 2007). Все используют порог --threshold.
+MATCH_METRICS = ('c-match', 'ok-match', 'good-match')
 
 def get_line_count(start, end):
     """Подсчитывает количество строк во фрагменте (0-индексация, включительно)."""
@@ -172,133 +201,477 @@ def extract_task_id_from_path(file_path_str):
         # print(f"[EXTRACT_TASK_ID_DEBUG] Ошибка при извлечении task_id из {file_path_str}: {e}")
         return None
 
-def main():
-    parser = argparse.ArgumentParser(description="Оценка результатов детектора клонов относительно эталонного бенчмарка.")
-    parser.add_argument("--benchmark_csv", type=str, required=True, help="Путь к CSV файлу эталонного бенчмарка (например, clones_2017.csv).")
-    parser.add_argument("--tool_db", type=str, required=True, help="Путь к файлу БД SQLite с результатами работы детектора.")
-    parser.add_argument("--threshold", type=float, default=0.7, help="Порог покрытия для c-match (по умолчанию 0.7).")
-    parser.add_argument("--tool_table_name", type=str, default="detected_clones", help="Имя таблицы в БД с результатами детектора (по умолчанию 'detected_clones').")
-    
-    args = parser.parse_args()
+@lru_cache(maxsize=None)
+def resolve_benchmark_path(p_str):
+    """Пути в benchmark_csv типа '../extracted_solutions/...' разрешаются относительно директории скрипта."""
+    return str(SCRIPT_DIR.joinpath(p_str).resolve())
 
-    # --- Убираем или комментируем тестовый блок для основной работы ---
-    # print("--- Тестирование calculate_c_match ---")
-    # ... (тестовый блок как был)
-    # print("--- Конец Тестового блока ---")
+@lru_cache(maxsize=None)
+def resolve_tool_path(p_str):
+    """
+    Пути детектора должны быть уже абсолютными, resolve() их просто нормализует.
+    Относительные пути разрешаются относительно текущей рабочей директории.
+    """
+    return str(pathlib.Path(p_str).resolve())
 
-    print(f"Загрузка эталонного бенчмарка из: {args.benchmark_csv}")
-    if not os.path.exists(args.benchmark_csv):
-        print(f"Ошибка: Файл эталонного бенчмарка не найден: {args.benchmark_csv}")
-        return
+def parse_coord(value):
+    """Преобразует координату из CSV в int. Возвращает None для нечисловых значений."""
     try:
-        script_dir = pathlib.Path(__file__).parent.resolve()
-        print(f"Директория скрипта: {script_dir}")
-        
-        benchmark_df = pd.read_csv(args.benchmark_csv)
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        if number != number or number in (float('inf'), float('-inf')): # NaN или бесконечность
+            return None
+        return int(number)
 
-        def resolve_benchmark_path(p_str):
-            # Пути в benchmark_csv типа '../extracted_solutions/...' относительно директории скрипта
-            return str(script_dir.joinpath(p_str).resolve())
+def canonical_pair(f1_path, f1_start, f1_end, f2_path, f2_start, f2_end):
+    """
+    Приводит пару клонов к каноническому виду: (min путь, max путь) с соответствующими координатами.
+    Прямое и обратное совпадение файлов из calculate_c_match после этого сводятся к одному ключу.
+    """
+    if f1_path > f2_path:
+        return f2_path, f2_start, f2_end, f1_path, f1_start, f1_end
+    return f1_path, f1_start, f1_end, f2_path, f2_start, f2_end
 
-        benchmark_df['file1_path'] = benchmark_df['file1_path'].apply(resolve_benchmark_path)
-        benchmark_df['file2_path'] = benchmark_df['file2_path'].apply(resolve_benchmark_path)
-        
-        if not benchmark_df.empty:
-            print(f"Пример разрешенного пути из эталона: {benchmark_df.iloc[0]['file1_path']}")
+def list_detector_csv_files(tool_csv):
+    """Возвращает список CSV файлов детектора: сам файл или все *.csv шарды директории (в отсортированном порядке)."""
+    if os.path.isdir(tool_csv):
+        return sorted(glob.glob(os.path.join(tool_csv, '*.csv')))
+    return [tool_csv]
 
-    except Exception as e:
-        print(f"Ошибка при чтении или разрешении путей в эталонном CSV: {e}")
-        return
-    
-    print(f"Заголовки в эталонном бенчмарке: {benchmark_df.columns.tolist()}")
-    print(f"Загружено эталонных пар: {len(benchmark_df)}")
+def iter_detector_csv_stream(f, source_name, stats):
+    """
+    Потоково читает открытый CSV поток детектора и возвращает пары с разрешенными путями:
+    (путь1, start1, end1, путь2, start2, end2).
+    Строки с некорректными координатами пропускаются, как в load_tool_results_to_db.py.
+    """
+    reader = csv.DictReader(f)
+    missing_columns = [col for col in REQUIRED_TOOL_COLUMNS if col not in (reader.fieldnames or [])]
+    if missing_columns:
+        raise ValueError(f"В CSV {source_name} отсутствуют необходимые колонки: {', '.join(missing_columns)}")
+    for row in reader:
+        coords = [parse_coord(row[col]) for col in COORD_COLUMNS]
+        if None in coords or not row['file1_path'] or not row['file2_path']:
+            stats['skipped_rows'] += 1
+            continue
+        yield (resolve_tool_path(row['file1_path']), coords[0], coords[1],
+               resolve_tool_path(row['file2_path']), coords[2], coords[3])
 
-    print(f"Загрузка результатов детектора из БД: {args.tool_db}, таблица: {args.tool_table_name}")
-    if not os.path.exists(args.tool_db):
-        print(f"Ошибка: Файл БД детектора не найден: {args.tool_db}")
-        return
+def iter_detector_csv_rows(csv_files, stats):
+    """
+    Потоково читает CSV файлы детектора и возвращает (номер, путь1, start1, end1, путь2, start2, end2).
+    Номер сохраняет исходный порядок пар (как id в БД) для детерминированного сопоставления.
+    """
+    def iter_files():
+        for csv_file in csv_files:
+            with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+                yield from iter_detector_csv_stream(f, csv_file, stats)
+
+    for seq, row in enumerate(iter_files()):
+        yield (seq,) + row
+
+def parse_detector_db_row(db_row, stats=None):
+    """
+    Строка таблицы детектора (путь1, start1, end1, путь2, start2, end2) -> пара с разрешенными путями.
+    Для строк с пустыми путями или некорректными координатами (NULL, текст) возвращает None
+    и учитывает их в stats['skipped_rows'], если stats передан.
+    """
+    f1_path, f1_start, f1_end, f2_path, f2_start, f2_end = db_row
+    coords = [parse_coord(value) for value in (f1_start, f1_end, f2_start, f2_end)]
+    if None in coords or not f1_path or not f2_path:
+        if stats is not None:
+            stats['skipped_rows'] += 1
+        return None
+    return resolve_tool_path(f1_path), coords[0], coords[1], resolve_tool_path(f2_path), coords[2], coords[3]
+
+def iter_detector_db_rows(db_path, table_name, stats=None):
+    """
+    Потоково читает результаты детектора из БД SQLite: (номер, путь1, start1, end1, путь2, start2, end2).
+    Некорректные строки пропускаются, как в CSV (см. parse_detector_db_row).
+    """
+    conn = sqlite3.connect(db_path)
     try:
-        conn = sqlite3.connect(args.tool_db)
-        tool_df = pd.read_sql_query(f"SELECT * FROM {args.tool_table_name}", conn)
+        cursor = conn.execute(
+            f"SELECT file1_path, file1_start, file1_end, file2_path, file2_start, file2_end FROM {table_name}"
+        )
+        for seq, db_row in enumerate(cursor):
+            row = parse_detector_db_row(db_row, stats)
+            if row is not None:
+                yield (seq,) + row
+    finally:
         conn.close()
 
-        def resolve_tool_path(p_str):
-            # Пути в tool_df (из smart_mock_results) должны быть уже абсолютными
-            # resolve() для абсолютного пути просто его нормализует
-            # Если бы они были относительными, то их следовало бы разрешать относительно корня проекта или текущей рабочей директории
-            return str(pathlib.Path(p_str).resolve()) 
-            
-        tool_df['file1_path'] = tool_df['file1_path'].apply(resolve_tool_path)
-        tool_df['file2_path'] = tool_df['file2_path'].apply(resolve_tool_path)
+def iter_detector_records(csv_files, stats):
+    """
+    Канонические записи сортировки для CSV файлов детектора:
+    (путь1, путь2, порядковый номер, start1, end1, start2, end2, '').
+    """
+    for seq, f1_path, f1_start, f1_end, f2_path, f2_start, f2_end in iter_detector_csv_rows(csv_files, stats):
+        p1, s1, e1, p2, s2, e2 = canonical_pair(f1_path, f1_start, f1_end, f2_path, f2_start, f2_end)
+        yield (p1, p2, seq, s1, e1, s2, e2, '')
 
-        if not tool_df.empty:
-            print(f"Пример разрешенного пути из tool_df: {tool_df.iloc[0]['file1_path']}")
+def iter_benchmark_records(benchmark_csv):
+    """Потоково читает эталонный CSV и возвращает канонические записи сортировки (с task_id в последнем поле)."""
+    with open(benchmark_csv, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        for seq, row in enumerate(reader):
+            p1, s1, e1, p2, s2, e2 = canonical_pair(
+                resolve_benchmark_path(row['file1_path']), int(row['file1_start']), int(row['file1_end']),
+                resolve_benchmark_path(row['file2_path']), int(row['file2_start']), int(row['file2_end'])
+            )
+            yield (p1, p2, seq, s1, e1, s2, e2, str(row.get('task_id', '')))
 
-    except Exception as e:
-        print(f"Ошибка при чтении или разрешении путей в БД детектора: {e}")
+def _write_sort_run(records, tmp_dir):
+    """Записывает отсортированный прогон во временный файл (последовательная запись)."""
+    fd, run_path = tempfile.mkstemp(prefix='run_', suffix='.csv', dir=tmp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(records)
+    return run_path
+
+def _read_sort_run(run_path, buffer_size):
+    """Последовательно читает прогон и удаляет его после полного прочтения."""
+    with open(run_path, 'r', encoding='utf-8', newline='', buffering=buffer_size) as f:
+        for p1, p2, seq, s1, e1, s2, e2, task in csv.reader(f):
+            yield (p1, p2, int(seq), int(s1), int(e1), int(s2), int(e2), task)
+    os.remove(run_path)
+
+def external_sort(records, tmp_dir, memory_limit_bytes):
+    """
+    Внешняя сортировка записей с ограниченной памятью.
+    Записи накапливаются, пока их оценочный размер не превысит memory_limit_bytes,
+    затем сортируются и сбрасываются в прогон на диск. Прогоны сливаются через heapq.merge
+    (при необходимости в несколько проходов, не более MAX_MERGE_FAN_IN прогонов за раз).
+    Если все данные поместились в память, диск не используется.
+    """
+    runs = []
+    buffer = []
+    buffer_bytes = 0
+    for record in records:
+        buffer.append(record)
+        buffer_bytes += SORT_RECORD_OVERHEAD_BYTES + len(record[0]) + len(record[1]) + len(record[7])
+        if buffer_bytes >= memory_limit_bytes:
+            buffer.sort()
+            runs.append(_write_sort_run(buffer, tmp_dir))
+            buffer = []
+            buffer_bytes = 0
+
+    if not runs:
+        buffer.sort()
+        yield from buffer
         return
+    if buffer:
+        buffer.sort()
+        runs.append(_write_sort_run(buffer, tmp_dir))
+        buffer = []
 
-    print(f"Заголовки в результатах детектора (после нормализации путей): {tool_df.columns.tolist()}")
-    print(f"Загружено пар от детектора: {len(tool_df)}")
+    buffer_size = max(MIN_RUN_BUFFER_BYTES, memory_limit_bytes // (2 * MAX_MERGE_FAN_IN))
+    # Промежуточные проходы слияния, пока прогонов больше, чем допустимо сливать одновременно
+    while len(runs) > MAX_MERGE_FAN_IN:
+        merged_runs = []
+        for i in range(0, len(runs), MAX_MERGE_FAN_IN):
+            group = runs[i:i + MAX_MERGE_FAN_IN]
+            merged = heapq.merge(*[_read_sort_run(r, buffer_size) for r in group])
+            merged_runs.append(_write_sort_run(merged, tmp_dir))
+        runs = merged_runs
 
-    # Извлечение task_id для tool_df
-    print("Извлечение task_id для результатов детектора...")
-    tool_df['task_id'] = tool_df['file1_path'].apply(extract_task_id_from_path)
-    
-    # Проверим, сколько task_id удалось извлечь
-    valid_task_ids_in_tool_df = tool_df['task_id'].notna().sum()
-    print(f"Успешно извлечено task_id для {valid_task_ids_in_tool_df} из {len(tool_df)} пар детектора.")
-    if valid_task_ids_in_tool_df == 0 and len(tool_df) > 0:
-        print("Предупреждение: Не удалось извлечь task_id ни для одной пары из детектора. Сопоставление по task_id будет неэффективным.")
-        # Можно здесь либо остановить, либо продолжить без фильтрации по task_id,
-        # но пользователь просил "самый оптимизированный", так что это проблема.
+    yield from heapq.merge(*[_read_sort_run(r, buffer_size) for r in runs])
 
-    matched_benchmark_indices = set()
-    used_tool_indices = set()
+def fragment_match_scores(b_start, b_end, t_start, t_end):
+    """
+    Показатели совпадения одного эталонного (b) и одного обнаруженного (t) фрагмента.
+    Возвращает: (покрытие эталона детектором, покрытие детектора эталоном, overlap / union)
+    """
+    cov_b_by_t, cov_t_by_b = calculate_fragment_coverage(b_start, b_end, t_start, t_end)
+    if cov_b_by_t == 0 or cov_t_by_b == 0:
+        return cov_b_by_t, cov_t_by_b, 0.0
+    # Оба покрытия ненулевые: overlap / union = 1 / (1 / cov_b + 1 / cov_t - 1)
+    return cov_b_by_t, cov_t_by_b, 1.0 / (1.0 / cov_b_by_t + 1.0 / cov_t_by_b - 1.0)
 
-    print("\nНачинаем сопоставление клонов...")
-    # Используем tqdm для прогресс-бара, если он установлен
+def clone_match_flags(b_frag, t_frag, threshold):
+    """
+    Проверяет все варианты критериев для канонически упорядоченных пар фрагментов (start1, end1, start2, end2).
+    c-match:    все четыре покрытия >= threshold (как calculate_c_match).
+    ok-match:   для каждого файла max(покрытий) >= threshold (один фрагмент в основном содержит другой).
+    good-match: для каждого файла overlap / union >= threshold.
+    Возвращает кортеж булевых значений в порядке MATCH_METRICS.
+    """
+    cov_b1, cov_t1, good1 = fragment_match_scores(b_frag[0], b_frag[1], t_frag[0], t_frag[1])
+    cov_b2, cov_t2, good2 = fragment_match_scores(b_frag[2], b_frag[3], t_frag[2], t_frag[3])
+    return (
+        min(cov_b1, cov_t1, cov_b2, cov_t2) >= threshold,
+        min(max(cov_b1, cov_t1), max(cov_b2, cov_t2)) >= threshold,
+        min(good1, good2) >= threshold,
+    )
+
+class FragmentIntervalIndex:
+    """
+    Интервальный индекс фрагментов детектора одной пары файлов по первому файлу.
+    Фрагменты отсортированы по началу, для каждой позиции хранится префиксный максимум концов
+    (плоское интервальное дерево): пересекающиеся с запросом фрагменты находятся бинарным поиском
+    по началу и обратным проходом, который останавливается, как только префиксный максимум
+    концов становится меньше начала запроса.
+    """
+
+    def __init__(self, tool_frags):
+        self.size = len(tool_frags)
+        valid = [pos for pos, frag in enumerate(tool_frags) if get_line_count(frag[0], frag[1]) > 0]
+        # Пустые/некорректные фрагменты не пересекаются ни с чем, но совпадают с пустыми эталонными
+        self.invalid_positions = [pos for pos, frag in enumerate(tool_frags) if get_line_count(frag[0], frag[1]) == 0]
+        valid.sort(key=lambda pos: tool_frags[pos][0])
+        self.positions = valid
+        self.starts = [tool_frags[pos][0] for pos in valid]
+        self.ends = [tool_frags[pos][1] for pos in valid]
+        self.max_ends = list(itertools.accumulate(self.ends, max))
+
+    def overlapping(self, query_start, query_end):
+        """Позиции (в исходном порядке) фрагментов, пересекающихся с [query_start, query_end] в первом файле."""
+        found = []
+        i = bisect_right(self.starts, query_end) - 1
+        while i >= 0 and self.max_ends[i] >= query_start:
+            if self.ends[i] >= query_start:
+                found.append(self.positions[i])
+            i -= 1
+        found.sort()
+        return found
+
+    def candidates(self, b_frag, threshold):
+        """
+        Кандидаты для эталонного фрагмента: при threshold > 0 любой критерий требует хотя бы
+        одной общей строки в первом файле, поэтому достаточно пересекающихся фрагментов.
+        """
+        if threshold <= 0:
+            return range(self.size)
+        if get_line_count(b_frag[0], b_frag[1]) == 0:
+            return self.invalid_positions
+        return self.overlapping(b_frag[0], b_frag[1])
+
+def match_clone_group(benchmark_frags, tool_frags, threshold):
+    """
+    Жадное сопоставление внутри одной канонической пары файлов за один проход для всех критериев MATCH_METRICS.
+    benchmark_frags, tool_frags: списки (start1, end1, start2, end2) в исходном порядке.
+    Как и раньше, для каждого критерия каждый эталонный клон берет первый (в исходном порядке)
+    еще не использованный этим критерием клон детектора. Кандидаты берутся из FragmentIntervalIndex,
+    поэтому плотный фрагментный вывод детектора не приводит к квадратичному перебору.
+    Возвращает: {критерий: (позиции сопоставленных эталонных клонов, множество позиций использованных клонов детектора)}
+    """
+    index = FragmentIntervalIndex(tool_frags)
+    matched = {metric: [] for metric in MATCH_METRICS}
+    used = {metric: set() for metric in MATCH_METRICS}
+    for b_pos, b_frag in enumerate(benchmark_frags):
+        pending = list(range(len(MATCH_METRICS)))
+        for t_pos in index.candidates(b_frag, threshold):
+            flags = clone_match_flags(b_frag, tool_frags[t_pos], threshold)
+            for m in list(pending):
+                metric = MATCH_METRICS[m]
+                if flags[m] and t_pos not in used[metric]:
+                    used[metric].add(t_pos)
+                    matched[metric].append(b_pos)
+                    pending.remove(m)
+            if not pending:
+                break
+    return {metric: (matched[metric], used[metric]) for metric in MATCH_METRICS}
+
+def new_evaluation_result():
+    """
+    Накопитель результатов оценки:
+    matched_benchmark - номера сопоставленных эталонных пар, used_tool - номера использованных пар детектора
+    (для каждого критерия MATCH_METRICS).
+    """
+    return {
+        'total_benchmark': 0,
+        'total_tool': 0,
+        'matched_benchmark': {metric: set() for metric in MATCH_METRICS},
+        'used_tool': {metric: set() for metric in MATCH_METRICS},
+    }
+
+def evaluate_clone_group(result, benchmark_seqs, benchmark_frags, tool_seqs, tool_frags, threshold):
+    """Сопоставляет одну каноническую пару файлов и добавляет сопоставления в result."""
+    for metric, (matched_positions, used_positions) in match_clone_group(benchmark_frags, tool_frags, threshold).items():
+        result['matched_benchmark'][metric].update(benchmark_seqs[pos] for pos in matched_positions)
+        result['used_tool'][metric].update(tool_seqs[pos] for pos in used_positions)
+
+def group_clone_pairs(rows):
+    """
+    Группирует пары клонов по каноническому ключу (путь1, путь2).
+    rows: итерируемое (номер, путь1, start1, end1, путь2, start2, end2) в исходном порядке.
+    Возвращает {ключ: (список номеров, список фрагментов (start1, end1, start2, end2))}.
+    """
+    groups = {}
+    for seq, f1_path, f1_start, f1_end, f2_path, f2_start, f2_end in rows:
+        p1, s1, e1, p2, s2, e2 = canonical_pair(f1_path, f1_start, f1_end, f2_path, f2_start, f2_end)
+        seqs, frags = groups.setdefault((p1, p2), ([], []))
+        seqs.append(seq)
+        frags.append((s1, e1, s2, e2))
+    return groups
+
+def load_benchmark_groups(benchmark_csv):
+    """
+    Потоково читает эталонный CSV и группирует пары по каноническому ключу (см. group_clone_pairs).
+    Возвращает: (группы, всего эталонных пар)
+    """
+    groups = {}
+    total = 0
+    for p1, p2, seq, s1, e1, s2, e2, _ in iter_benchmark_records(benchmark_csv):
+        seqs, frags = groups.setdefault((p1, p2), ([], []))
+        seqs.append(seq)
+        frags.append((s1, e1, s2, e2))
+        total += 1
+    return groups, total
+
+class InMemoryBenchmark:
+    """
+    Эталон, сгруппированный в памяти при каждом запуске (без постоянного индекса).
+    Интерфейс совпадает с benchmark_index.BenchmarkIndex: benchmark.get((путь1, путь2)) -> (номера, фрагменты).
+    """
+
+    def __init__(self, benchmark_csv):
+        self.groups, self.total = load_benchmark_groups(benchmark_csv)
+        self.sampling_weights = load_sampling_weights(benchmark_csv)
+        self.clone_types = load_clone_types(benchmark_csv)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __contains__(self, key):
+        return key in self.groups
+
+    def __getitem__(self, key):
+        return self.groups[key]
+
+    def get(self, key, default=None):
+        return self.groups.get(key, default)
+
+    def sampling_summary(self, matched_benchmark_seqs):
+        if self.sampling_weights is None:
+            return None
+        return summarize_sampling_weights(self.sampling_weights, matched_benchmark_seqs)
+
+    def clone_type_summary(self, matched_benchmark_seqs):
+        if self.clone_types is None:
+            return None
+        return summarize_clone_types(self.clone_types, matched_benchmark_seqs)
+
+def open_benchmark_index(benchmark_csv, build=True, rebuild=False):
+    """
+    Открывает постоянный индекс эталона (benchmark_index.py), при необходимости собирая его.
+    build=False: вернуть индекс только если он уже актуален.
+    Возвращает None, если индекс недоступен (нет numpy, нет прав на запись рядом с CSV, индекс пересобирается
+    параллельным процессом и т.п.).
+    """
     try:
-        from tqdm import tqdm
-        benchmark_iterable = tqdm(benchmark_df.iterrows(), total=len(benchmark_df), desc="Сопоставление эталонных клонов")
-    except ImportError:
-        print("Библиотека tqdm не найдена, прогресс-бар не будет отображаться.")
-        benchmark_iterable = benchmark_df.iterrows()
-
-    for b_idx, benchmark_clone_row in benchmark_iterable:
-        # ---- TEMPORARY LIMITER FOR DEBUGGING ----
-        # if b_idx >= 20000: # Обработаем только первые N строк для отладки
-        #     print(f"[DEBUG] Достигнут лимит обработки benchmark_df в {b_idx} строк для отладки.")
-        #     break
-        # ---- END TEMPORARY LIMITER ----
-
-        b_task_id = str(benchmark_clone_row['task_id']) # Убедимся, что тип task_id совпадает
-
-        # Фильтруем tool_df по task_id и по тем, что еще не использованы
-        # Важно: tool_df['task_id'] также должен быть строкой для корректного сравнения
-        candidate_tool_clones_df = tool_df[
-            (tool_df['task_id'].astype(str) == b_task_id) & \
-            (~tool_df.index.isin(used_tool_indices))
-        ]
-
-        for t_idx, tool_clone_row in candidate_tool_clones_df.iterrows():
-            # tool_clone_row уже является словарем (pd.Series), когда получаем из iterrows()
-            # --- DEBUG LOGGING ---
-            # print(f"[MAIN_LOOP_DEBUG] Comparing B_IDX={b_idx} (Task: {b_task_id}, B1_Path: {benchmark_clone_row['file1_path']}) with T_IDX={t_idx} (Task: {tool_clone_row['task_id']}, T1_Path: {tool_clone_row['file1_path']})")
-            # --- END DEBUG LOGGING ---
-            if calculate_c_match(benchmark_clone_row, tool_clone_row, args.threshold):
-                matched_benchmark_indices.add(b_idx)
-                used_tool_indices.add(t_idx)
-                break # Переходим к следующему эталонному клону
-
-    TP = len(matched_benchmark_indices)
-    total_benchmark_clones = len(benchmark_df)
-    FN = total_benchmark_clones - TP
-    
-    total_tool_clones = len(tool_df)
-    FP = total_tool_clones - len(used_tool_indices)
+        from benchmark_index import check_index_freshness, get_index_dir, load_benchmark_index, BenchmarkIndex
+    except ImportError as e:
+        print(f"Постоянный индекс эталона недоступен ({e}), эталон будет загружен в память.")
+        return None
+    try:
+        if not build:
+            fresh, _ = check_index_freshness(benchmark_csv, get_index_dir(benchmark_csv))
+            return BenchmarkIndex(get_index_dir(benchmark_csv)) if fresh else None
+        return load_benchmark_index(benchmark_csv, rebuild=rebuild)
+    except (OSError, ValueError) as e:
+        print(f"Предупреждение: не удалось использовать индекс эталона ({e}), эталон будет загружен в память.")
+        return None
+
+def load_benchmark(benchmark_csv, use_index=True, rebuild_index=False):
+    """Загружает эталон: из постоянного индекса (по умолчанию) или группировкой CSV в памяти."""
+    if use_index:
+        index = open_benchmark_index(benchmark_csv, rebuild=rebuild_index)
+        if index is not None:
+            return index
+    return InMemoryBenchmark(benchmark_csv)
+
+def evaluate_tool_rows(benchmark, tool_rows, threshold):
+    """
+    Оценивает пары детектора (номер, путь1, start1, end1, путь2, start2, end2) относительно
+    заранее сгруппированного эталона (InMemoryBenchmark или BenchmarkIndex).
+    Возвращает накопитель результатов (см. new_evaluation_result).
+    """
+    tool_groups = group_clone_pairs(tool_rows)
+    result = new_evaluation_result()
+    result['total_benchmark'] = benchmark.total
+    for key, (t_seqs, t_frags) in tool_groups.items():
+        result['total_tool'] += len(t_seqs)
+        benchmark_group = benchmark.get(key)
+        if benchmark_group is not None:
+            b_seqs, b_frags = benchmark_group
+            evaluate_clone_group(result, b_seqs, b_frags, t_seqs, t_frags, threshold)
+    return result
+
+def merge_join_evaluate(benchmark_sorted, tool_sorted, threshold):
+    """
+    Один последовательный проход слиянием двух отсортированных по (путь1, путь2) потоков.
+    Возвращает накопитель результатов (см. new_evaluation_result).
+    """
+    def group_key(record):
+        return record[0], record[1]
+
+    def seqs_and_frags(group):
+        records = list(group)
+        return [r[2] for r in records], [(r[3], r[4], r[5], r[6]) for r in records]
+
+    result = new_evaluation_result()
+    benchmark_groups = itertools.groupby(benchmark_sorted, key=group_key)
+    tool_groups = itertools.groupby(tool_sorted, key=group_key)
+    b_key, b_group = next(benchmark_groups, (None, None))
+    t_key, t_group = next(tool_groups, (None, None))
+
+    while b_key is not None and t_key is not None:
+        if b_key < t_key:
+            result['total_benchmark'] += sum(1 for _ in b_group)
+            b_key, b_group = next(benchmark_groups, (None, None))
+        elif t_key < b_key:
+            result['total_tool'] += sum(1 for _ in t_group)
+            t_key, t_group = next(tool_groups, (None, None))
+        else:
+            b_seqs, b_frags = seqs_and_frags(b_group)
+            t_seqs, t_frags = seqs_and_frags(t_group)
+            result['total_benchmark'] += len(b_seqs)
+            result['total_tool'] += len(t_seqs)
+            evaluate_clone_group(result, b_seqs, b_frags, t_seqs, t_frags, threshold)
+            b_key, b_group = next(benchmark_groups, (None, None))
+            t_key, t_group = next(tool_groups, (None, None))
+
+    # Хвосты без пары с другой стороны
+    while b_key is not None:
+        result['total_benchmark'] += sum(1 for _ in b_group)
+        b_key, b_group = next(benchmark_groups, (None, None))
+    while t_key is not None:
+        result['total_tool'] += sum(1 for _ in t_group)
+        t_key, t_group = next(tool_groups, (None, None))
 
-    # Расчет метрик
+    return result
+
+def evaluate_sort_merge(benchmark_csv, tool_csv, threshold, memory_limit_mb, tmp_dir=None, benchmark_index=None):
+    """
+    Оценка без загрузки в БД и без pandas: обе стороны нормализуются к каноническим ключам,
+    сортируются внешней сортировкой с ограничением памяти и сопоставляются слиянием за один проход.
+    Лимит памяти делится поровну между сортировками эталона и детектора.
+    Если передан актуальный benchmark_index, эталон читается из него уже отсортированным.
+    """
+    csv_files = list_detector_csv_files(tool_csv)
+    if not csv_files:
+        raise ValueError(f"В директории {tool_csv} не найдено CSV файлов детектора.")
+    print(f"Файлов результатов детектора: {len(csv_files)}")
+
+    memory_limit_bytes = max(1, int(memory_limit_mb * 1024 * 1024) // 2)
+    stats = {'skipped_rows': 0}
+    with tempfile.TemporaryDirectory(prefix='clone_eval_', dir=tmp_dir) as sort_dir:
+        if benchmark_index is not None:
+            benchmark_sorted = benchmark_index.iter_sorted_records()
+        else:
+            benchmark_sorted = external_sort(iter_benchmark_records(benchmark_csv), sort_dir, memory_limit_bytes)
+        tool_sorted = external_sort(iter_detector_records(csv_files, stats), sort_dir, memory_limit_bytes)
+        result = merge_join_evaluate(benchmark_sorted, tool_sorted, threshold)
+
+    if stats['skipped_rows']:
+        print(f"Предупреждение: {stats['skipped_rows']} строк детектора пропущены из-за некорректных координат.")
+    return result
+
+def print_results(total_benchmark_clones, total_tool_clones, threshold, TP, FP, FN):
+    """Рассчитывает и выводит итоговые метрики."""
     precision = TP / (TP + FP) if (TP + FP) > 0 else 0
     recall = TP / (TP + FN) if (TP + FN) > 0 else 0
     f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
@@ -306,7 +679,7 @@ def main():
     print("\n--- Результаты оценки ---")
     print(f"Всего эталонных пар: {total_benchmark_clones}")
     print(f"Всего обнаруженных пар детектором: {total_tool_clones}")
-    print(f"Порог c-match: {args.threshold}")
+    print(f"Порог c-match: {threshold}")
     print("-------------------------")
     print(f"True Positives (TP):  {TP}")
     print(f"False Positives (FP): {FP}")
@@ -317,5 +690,548 @@ def main():
     print(f"F1-Score:  {f1_score:.4f}")
     print("-------------------------")
 
+def print_match_variants(result):
+    """Выводит TP/FP/FN и метрики для всех критериев сопоставления (c-match, ok-match, good-match)."""
+    print("\n--- Варианты критериев сопоставления ---")
+    print(f"{'Критерий':<12} {'TP':>10} {'FP':>10} {'FN':>10} {'Precision':>10} {'Recall':>8} {'F1':>8}")
+    for metric in MATCH_METRICS:
+        TP = len(result['matched_benchmark'][metric])
+        FP = result['total_tool'] - len(result['used_tool'][metric])
+        FN = result['total_benchmark'] - TP
+        precision = TP / (TP + FP) if (TP + FP) > 0 else 0
+        recall = TP / (TP + FN) if (TP + FN) > 0 else 0
+        f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+        print(f"{metric:<12} {TP:>10} {FP:>10} {FN:>10} {precision:>10.4f} {recall:>8.4f} {f1_score:>8.4f}")
+    print("-------------------------")
+
+def load_sampling_weights(benchmark_csv):
+    """
+    Для выборочного бенчмарка (build_benchmark.py --max_pairs_per_task) читает веса выборки:
+    вес пары - это число пар полного бенчмарка, которое она представляет.
+    Возвращает список (страта, вес) по номерам строк эталонного CSV или None, если весов нет.
+    """
+    with open(benchmark_csv, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        if 'weight' not in (reader.fieldnames or []):
+            return None
+        return [(row.get('size_stratum') or 'all', float(row['weight'])) for row in reader]
+
+def summarize_sampling_weights(sampling_weights, matched_benchmark_seqs):
+    """
+    Суммирует веса выборки по стратам размера.
+    matched_benchmark_seqs: номера строк эталонного CSV (с 0), сопоставленных с детектором.
+    Возвращает словарь {страта: [пар в выборке, сумма весов, сумма весов TP]}.
+    """
+    summary = {}
+    for seq, (stratum, weight) in enumerate(sampling_weights):
+        stats = summary.setdefault(stratum, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += weight
+        if seq in matched_benchmark_seqs:
+            stats[2] += weight
+    return summary
+
+def print_sampling_estimate(summary):
+    """Выводит веса выборки и оценку полноты (Horvitz-Thompson) для полного бенчмарка."""
+    print("\n--- Оценка для полного бенчмарка по весам выборки ---")
+    print(f"{'Страта':<10} {'Пар в выборке':>14} {'Пар в полном (оценка)':>22} {'TP (оценка)':>14} {'Recall':>8}")
+    total_sampled = 0
+    total_weight = total_weight_tp = 0.0
+    for stratum in sorted(summary):
+        sampled, weight, weight_tp = summary[stratum]
+        total_sampled += sampled
+        total_weight += weight
+        total_weight_tp += weight_tp
+        recall = weight_tp / weight if weight > 0 else 0
+        print(f"{stratum:<10} {sampled:>14} {weight:>22.1f} {weight_tp:>14.1f} {recall:>8.4f}")
+    recall = total_weight_tp / total_weight if total_weight > 0 else 0
+    print(f"{'Итого':<10} {total_sampled:>14} {total_weight:>22.1f} {total_weight_tp:>14.1f} {recall:>8.4f}")
+    print("Примечание: Precision по выборочному бенчмарку занижена - пары детектора, соответствующие")
+    print("не попавшим в выборку эталонным парам, считаются FP.")
+    print("-------------------------")
+
+def load_clone_types(benchmark_csv):
+    """
+    Для размеченного бенчмарка (label_clone_types.py) читает типы клонов.
+    Возвращает список типов ('1'-'4', '' - не размечено) по номерам строк эталонного CSV или None, если разметки нет.
+    """
+    with open(benchmark_csv, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        if 'clone_type' not in (reader.fieldnames or []):
+            return None
+        return [row['clone_type'] or '' for row in reader]
+
+def clone_type_label(clone_type):
+    return f"Type-{clone_type}" if clone_type else 'Не размечено'
+
+def summarize_clone_types(clone_types, matched_benchmark_seqs):
+    """
+    Считает эталонные пары и TP по типам клонов.
+    Возвращает словарь {метка типа: [пар в эталоне, TP]}.
+    """
+    summary = {}
+    for seq, clone_type in enumerate(clone_types):
+        stats = summary.setdefault(clone_type_label(clone_type), [0, 0])
+        stats[0] += 1
+        if seq in matched_benchmark_seqs:
+            stats[1] += 1
+    return summary
+
+def print_clone_type_recall(summary):
+    """Выводит полноту (Recall) по типам клонов."""
+    print("\n--- Полнота по типам клонов ---")
+    print(f"{'Тип':<14} {'Пар':>10} {'TP':>10} {'FN':>10} {'Recall':>8}")
+    for label in sorted(summary):
+        pairs, tp = summary[label]
+        recall = tp / pairs if pairs > 0 else 0
+        print(f"{label:<14} {pairs:>10} {tp:>10} {pairs - tp:>10} {recall:>8.4f}")
+    print("-------------------------")
+
+def load_negative_pairs(negatives_csv):
+    """
+    Читает набор отрицательных пар (build_benchmark.py --num_negatives): пары решений разных задач.
+    Возвращает: (группы по каноническому ключу (см. load_benchmark_groups), список (тип, вес) по номерам строк CSV)
+    """
+    groups, _ = load_benchmark_groups(negatives_csv)
+    with open(negatives_csv, 'r', encoding='utf-8', newline='') as f:
+        negative_types = [(row.get('negative_type') or 'random', float(row.get('weight') or 1.0))
+                          for row in csv.DictReader(f)]
+    return groups, negative_types
+
+def evaluate_negative_pairs(negative_groups, tool_rows, threshold):
+    """
+    Сопоставляет пары детектора с отрицательными парами тем же жадным c-match, что и эталон:
+    отрицательная пара, с которой сопоставлена пара детектора, - ложное срабатывание на заведомом не-клоне.
+    Группируются только пары детектора из пар файлов набора, поэтому память не зависит от объема результатов.
+    Пары детектора между файлами разных задач считаются по уникальным парам файлов: несколько фрагментов
+    одной пары файлов - одна пара пространства, иначе доля пространства завышается.
+    Возвращает: (номера помеченных детектором отрицательных пар, число пар файлов разных задач, помеченных детектором)
+    """
+    task_of = lru_cache(maxsize=None)(extract_task_id_from_path)
+    cross_task_pairs = set()
+
+    def relevant_rows():
+        for row in tool_rows:
+            key = (min(row[1], row[4]), max(row[1], row[4]))
+            task_1, task_2 = task_of(row[1]), task_of(row[4])
+            if task_1 and task_2 and task_1 != task_2:
+                cross_task_pairs.add(key)
+            if key in negative_groups:
+                yield row
+
+    result = new_evaluation_result()
+    for key, (t_seqs, t_frags) in group_clone_pairs(relevant_rows()).items():
+        n_seqs, n_frags = negative_groups[key]
+        evaluate_clone_group(result, n_seqs, n_frags, t_seqs, t_frags, threshold)
+    return result['matched_benchmark']['c-match'], len(cross_task_pairs)
+
+def summarize_negatives(negative_types, flagged_seqs, cross_task_tool):
+    """
+    Суммирует отрицательные пары по типам ('hard', 'random').
+    Возвращает словарь {'types': {тип: [пар, помечено, сумма весов, сумма весов помеченных]}, 'cross_task_tool': число}.
+    """
+    types = {}
+    for seq, (negative_type, weight) in enumerate(negative_types):
+        stats = types.setdefault(negative_type, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        stats[2] += weight
+        if seq in flagged_seqs:
+            stats[1] += 1
+            stats[3] += weight
+    return {'types': types, 'cross_task_tool': cross_task_tool}
+
+def negative_pairs_summary(negatives_csv, tool_rows, threshold):
+    """Загружает набор отрицательных пар и оценивает на нем пары детектора (см. summarize_negatives)."""
+    negative_groups, negative_types = load_negative_pairs(negatives_csv)
+    flagged, cross_task_tool = evaluate_negative_pairs(negative_groups, tool_rows, threshold)
+    return summarize_negatives(negative_types, flagged, cross_task_tool)
+
+def print_negative_specificity(summary):
+    """Выводит ложные срабатывания на отрицательных парах, специфичность по типам и оценку по весам для всего межзадачного пространства."""
+    print("\n--- Отрицательные пары (решения разных задач) ---")
+    print(f"{'Тип':<10} {'Пар':>10} {'Помечено (FP)':>14} {'Specificity':>12} {'Пар в пространстве':>20}")
+    total_weight = total_weight_flagged = 0.0
+    for negative_type in sorted(summary['types']):
+        pairs, flagged, weight, weight_flagged = summary['types'][negative_type]
+        total_weight += weight
+        total_weight_flagged += weight_flagged
+        print(f"{negative_type:<10} {pairs:>10} {flagged:>14} {1 - flagged / pairs if pairs else 0:>12.4f} {weight:>20.1f}")
+    specificity = 1 - total_weight_flagged / total_weight if total_weight > 0 else 0
+    print(f"Specificity (оценка по весам для всех межзадачных пар): {specificity:.6f}")
+    print(f"Пар файлов разных задач, помеченных детектором (все - FP): {summary['cross_task_tool']}"
+          + (f" (FPR по пространству: {summary['cross_task_tool'] / total_weight:.6f})" if total_weight > 0 else ""))
+    print("-------------------------")
+
+def report_evaluation(result, threshold, sampling_summary=None, clone_type_summary=None, negative_summary=None):
+    """
+    Выводит итоговые метрики оценки (c-match), варианты критериев, полноту по типам клонов, оценку по весам выборки
+    и специфичность на отрицательных парах.
+    """
+    TP = len(result['matched_benchmark']['c-match'])
+    FP = result['total_tool'] - len(result['used_tool']['c-match'])
+    FN = result['total_benchmark'] - TP
+    print_results(result['total_benchmark'], result['total_tool'], threshold, TP, FP, FN)
+    print_match_variants(result)
+
+    if clone_type_summary is not None:
+        print_clone_type_recall(clone_type_summary)
+    if sampling_summary is not None:
+        print_sampling_estimate(sampling_summary)
+    if negative_summary is not None:
+        print_negative_specificity(negative_summary)
+
+def evaluation_metrics(result, threshold, sampling_summary=None, clone_type_summary=None):
+    """Итоговые метрики оценки в виде словаря (для JSON): по каждому критерию и, если есть, по типам клонов и весам выборки."""
+    metrics = {
+        'threshold': threshold,
+        'total_benchmark': result['total_benchmark'],
+        'total_tool': result['total_tool'],
+    }
+    for metric in MATCH_METRICS:
+        TP = len(result['matched_benchmark'][metric])
+        FP = result['total_tool'] - len(result['used_tool'][metric])
+        FN = result['total_benchmark'] - TP
+        precision = TP / (TP + FP) if (TP + FP) > 0 else 0
+        recall = TP / (TP + FN) if (TP + FN) > 0 else 0
+        f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+        metrics[metric] = {'TP': TP, 'FP': FP, 'FN': FN, 'precision': precision, 'recall': recall, 'f1': f1_score}
+    if clone_type_summary is not None:
+        metrics['clone_types'] = {
+            label: {'pairs': pairs, 'TP': tp, 'recall': tp / pairs if pairs > 0 else 0}
+            for label, (pairs, tp) in sorted(clone_type_summary.items())
+        }
+    if sampling_summary is not None:
+        summary = sampling_summary
+        total_weight = sum(stats[1] for stats in summary.values())
+        total_weight_tp = sum(stats[2] for stats in summary.values())
+        metrics['sampling_estimate'] = {
+            'strata': {
+                stratum: {'sampled': stats[0], 'weight': stats[1], 'weight_tp': stats[2],
+                          'recall': stats[2] / stats[1] if stats[1] > 0 else 0}
+                for stratum, stats in sorted(summary.items())
+            },
+            'total_weight': total_weight,
+            'recall': total_weight_tp / total_weight if total_weight > 0 else 0,
+        }
+    return metrics
+
+class IncrementalEvaluator:
+    """
+    Инкрементальная оценка для режима --follow: пары детектора поступают порциями в порядке номеров.
+    Жадное сопоставление (match_clone_group) берет для каждого эталонного клона первый подходящий клон детектора,
+    поэтому пара, добавленная в конец, не меняет уже сделанных сопоставлений: она может достаться только первому
+    (в исходном порядке) еще не сопоставленному эталонному клону своей пары файлов. Для каждой пары файлов
+    хранятся несопоставленные эталонные клоны по каждому критерию, и итог совпадает с пакетной оценкой.
+    """
+
+    def __init__(self, benchmark, threshold):
+        self.benchmark = benchmark
+        self.threshold = threshold
+        self.result = new_evaluation_result()
+        self.result['total_benchmark'] = benchmark.total
+        # Канонический ключ -> (номера, фрагменты, {критерий: позиции несопоставленных эталонных клонов})
+        self.groups = {}
+
+    def add_rows(self, tool_rows):
+        """Добавляет пары детектора (номер, путь1, start1, end1, путь2, start2, end2) с возрастающими номерами."""
+        result = self.result
+        for seq, f1_path, f1_start, f1_end, f2_path, f2_start, f2_end in tool_rows:
+            result['total_tool'] += 1
+            p1, s1, e1, p2, s2, e2 = canonical_pair(f1_path, f1_start, f1_end, f2_path, f2_start, f2_end)
+            key = (p1, p2)
+            state = self.groups.get(key)
+            if state is None:
+                benchmark_group = self.benchmark.get(key)
+                if benchmark_group is None:
+                    continue
+                b_seqs, b_frags = benchmark_group
+                state = self.groups[key] = (b_seqs, b_frags, {metric: list(range(len(b_seqs))) for metric in MATCH_METRICS})
+            b_seqs, b_frags, unmatched = state
+            t_frag = (s1, e1, s2, e2)
+            # Флаги всех критериев для пары фрагментов считаются один раз
+            flags = {}
+            for m, metric in enumerate(MATCH_METRICS):
+                positions = unmatched[metric]
+                for i, b_pos in enumerate(positions):
+                    if b_pos not in flags:
+                        flags[b_pos] = clone_match_flags(b_frags[b_pos], t_frag, self.threshold)
+                    if flags[b_pos][m]:
+                        del positions[i]
+                        result['matched_benchmark'][metric].add(b_seqs[b_pos])
+                        result['used_tool'][metric].add(seq)
+                        break
+
+def follow_csv_batches(csv_path, stats, poll_interval, idle_timeout=None):
+    """
+    Следит за растущим CSV детектора (как tail -f) и возвращает порции новых пар
+    (путь1, start1, end1, путь2, start2, end2). Если новых полных строк нет, возвращает пустую порцию
+    после ожидания poll_interval. Файл читается порциями по FOLLOW_READ_CHUNK_CHARS символов, поэтому и уже
+    записанная часть большого CSV оценивается порциями, без загрузки в память целиком.
+    Неполная последняя строка ждет завершения записи.
+    Если задан idle_timeout и файл не меняется дольше idle_timeout секунд, неполная строка считается
+    последней строкой без перевода строки и возвращается последней порцией, после чего поток завершается.
+    """
+    last_data = time.monotonic()
+
+    def idle():
+        return idle_timeout is not None and time.monotonic() - last_data >= idle_timeout
+
+    while not os.path.exists(csv_path):
+        if idle():
+            return
+        yield []
+        time.sleep(poll_interval)
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        header = None
+        pending = ''
+        finished = False
+        while not finished:
+            chunk = f.read(FOLLOW_READ_CHUNK_CHARS)
+            if chunk:
+                last_data = time.monotonic()
+            elif not idle():
+                yield []
+                time.sleep(poll_interval)
+                continue
+            else:
+                # Единственный таймер простоя: дописываем неполную строку и завершаем поток
+                finished = True
+                if not pending:
+                    break
+                chunk = '\n'
+            pending += chunk
+            complete, newline, pending = pending.rpartition('\n')
+            if not newline:
+                pending = complete + pending
+                continue
+            lines = (complete + newline).splitlines(keepends=True)
+            if header is None:
+                header = lines.pop(0)
+            yield list(iter_detector_csv_stream(itertools.chain([header], lines), csv_path, stats))
+
+def follow_db_batches(db_path, table_name, stats, poll_interval, idle_timeout=None, batch_size=100000):
+    """
+    Опрашивает таблицу результатов детектора и возвращает порции новых пар по возрастанию id
+    (порядок совпадает с пакетным чтением iter_detector_db_rows). Пока таблицы нет, возвращает пустые порции.
+    Некорректные строки пропускаются так же, как при пакетном чтении, и учитываются в stats['skipped_rows'].
+    Если задан idle_timeout, поток завершается, когда новых строк нет дольше idle_timeout секунд.
+    """
+    last_id = 0
+    last_data = time.monotonic()
+    conn = sqlite3.connect(db_path)
+    try:
+        while True:
+            try:
+                rows = conn.execute(
+                    f"SELECT id, file1_path, file1_start, file1_end, file2_path, file2_start, file2_end "
+                    f"FROM {table_name} WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                if 'no such table' not in str(e):
+                    raise
+                rows = []
+            if rows:
+                last_id = rows[-1][0]
+                last_data = time.monotonic()
+                batch = [parse_detector_db_row(row[1:], stats) for row in rows]
+                yield [row for row in batch if row is not None]
+            if len(rows) < batch_size:
+                if not rows:
+                    if idle_timeout is not None and time.monotonic() - last_data >= idle_timeout:
+                        return
+                    yield []
+                time.sleep(poll_interval)
+    finally:
+        conn.close()
+
+def publish_running_metrics(evaluator, rows_per_second, status_json=None):
+    """Выводит текущие TP/FP/Precision/Recall (c-match) и, если задано, атомарно записывает все метрики в JSON файл."""
+    result = evaluator.result
+    TP = len(result['matched_benchmark']['c-match'])
+    FP = result['total_tool'] - len(result['used_tool']['c-match'])
+    precision = TP / (TP + FP) if (TP + FP) > 0 else 0
+    recall = TP / result['total_benchmark'] if result['total_benchmark'] > 0 else 0
+    print(f"[{time.strftime('%H:%M:%S')}] Пар детектора: {result['total_tool']} ({rows_per_second:.0f}/с), "
+          f"TP: {TP}, FP: {FP}, Precision: {precision:.4f}, Recall: {recall:.4f}", flush=True)
+    if status_json:
+        metrics = evaluation_metrics(result, evaluator.threshold)
+        metrics['updated_at'] = time.time()
+        tmp_path = f"{status_json}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, status_json)
+
+def follow_evaluate(benchmark, batches, threshold, report_interval, status_json=None):
+    """
+    Инкрементально оценивает порции пар детектора по мере их появления и периодически публикует текущие метрики.
+    Precision по уже полученным парам точная: пара детектора, не сопоставленная при поступлении, не будет сопоставлена и позже.
+    Завершается по Ctrl+C или когда поток порций заканчивается (таймер простоя --idle_timeout ведут
+    follow_csv_batches и follow_db_batches, чтобы неполная последняя строка CSV успела попасть в оценку).
+    Возвращает накопитель результатов (как evaluate_tool_rows).
+    """
+    evaluator = IncrementalEvaluator(benchmark, threshold)
+    seq = 0
+    started = last_report = time.monotonic()
+    try:
+        for batch in batches:
+            now = time.monotonic()
+            if batch:
+                evaluator.add_rows((seq + i,) + row for i, row in enumerate(batch))
+                seq += len(batch)
+            if now - last_report >= report_interval:
+                publish_running_metrics(evaluator, seq / max(now - started, 1e-9), status_json)
+                last_report = now
+        print("Новых пар нет дольше --idle_timeout, завершение режима слежения.")
+    except KeyboardInterrupt:
+        print("\nСлежение остановлено пользователем.")
+    publish_running_metrics(evaluator, seq / max(time.monotonic() - started, 1e-9), status_json)
+    return evaluator.result
+
+def main():
+    parser = argparse.ArgumentParser(description="Оценка результатов детектора клонов относительно эталонного бенчмарка.")
+    parser.add_argument("--benchmark_csv", type=str, required=True, help="Путь к CSV файлу эталонного бенчмарка (например, clones_2017.csv).")
+    tool_source = parser.add_mutually_exclusive_group(required=True)
+    tool_source.add_argument("--tool_db", type=str, help="Путь к файлу БД SQLite с результатами работы детектора.")
+    tool_source.add_argument("--tool_csv", type=str, help=(
+        "Путь к CSV файлу детектора или к директории с CSV шардами. "
+        "Оценка выполняется внешней сортировкой и слиянием, без загрузки в БД."
+    ))
+    parser.add_argument("--threshold", type=float, default=0.7, help="Порог покрытия для c-match (по умолчанию 0.7).")
+    parser.add_argument("--tool_table_name", type=str, default="detected_clones", help="Имя таблицы в БД с результатами детектора (по умолчанию 'detected_clones').")
+    parser.add_argument("--memory_limit", type=float, default=512, help="Лимит памяти в МБ для внешней сортировки в режиме --tool_csv (по умолчанию 512).")
+    parser.add_argument("--tmp_dir", type=str, default=None, help="Директория для временных файлов внешней сортировки (по умолчанию системная).")
+    parser.add_argument("--no_index", action="store_true", help="Не использовать постоянный индекс эталона (clones_ГОД.csv.index/).")
+    parser.add_argument("--rebuild_index", action="store_true", help="Принудительно пересобрать постоянный индекс эталона.")
+    parser.add_argument("--follow", action="store_true", help=(
+        "Режим слежения: оценивать результаты детектора по мере их появления (растущий --tool_csv или новые строки "
+        "таблицы --tool_db по id) и периодически выводить текущие метрики. Итог совпадает с обычной оценкой."
+    ))
+    parser.add_argument("--poll_interval", type=float, default=2.0, help="Интервал опроса новых пар в режиме --follow, с (по умолчанию 2).")
+    parser.add_argument("--report_interval", type=float, default=30.0, help="Интервал вывода текущих метрик в режиме --follow, с (по умолчанию 30).")
+    parser.add_argument("--idle_timeout", type=float, default=None, help=(
+        "Завершить режим --follow, если новых пар нет дольше указанного числа секунд (по умолчанию - до Ctrl+C)."
+    ))
+    parser.add_argument("--status_json", type=str, default=None, help="Файл, в который в режиме --follow периодически записываются текущие метрики в JSON.")
+    parser.add_argument("--negatives_csv", type=str, default=None, help=(
+        "CSV с отрицательными парами (build_benchmark.py --num_negatives, negatives_ГОД.csv): "
+        "выводит ложные срабатывания на них и оценку специфичности для пар решений разных задач."
+    ))
+    
+    args = parser.parse_args()
+
+    print(f"Загрузка эталонного бенчмарка из: {args.benchmark_csv}")
+    if not os.path.exists(args.benchmark_csv):
+        print(f"Ошибка: Файл эталонного бенчмарка не найден: {args.benchmark_csv}")
+        return
+    if args.negatives_csv and not os.path.exists(args.negatives_csv):
+        print(f"Ошибка: Файл отрицательных пар не найден: {args.negatives_csv}")
+        return
+
+    if args.follow:
+        if args.negatives_csv:
+            print("Предупреждение: --negatives_csv в режиме --follow не используется.")
+        if args.tool_csv and os.path.isdir(args.tool_csv):
+            print("Ошибка: В режиме --follow --tool_csv должен указывать на один CSV файл.")
+            return
+        try:
+            benchmark = load_benchmark(args.benchmark_csv, use_index=not args.no_index, rebuild_index=args.rebuild_index)
+        except Exception as e:
+            print(f"Ошибка при чтении или разрешении путей в эталонном CSV: {e}")
+            return
+        print(f"Загружено эталонных пар: {benchmark.total} ({len(benchmark)} пар файлов)")
+        stats = {'skipped_rows': 0}
+        if args.tool_csv:
+            print(f"Слежение за CSV детектора: {args.tool_csv}")
+            batches = follow_csv_batches(args.tool_csv, stats, args.poll_interval, args.idle_timeout)
+        else:
+            print(f"Слежение за БД детектора: {args.tool_db}, таблица: {args.tool_table_name}")
+            batches = follow_db_batches(args.tool_db, args.tool_table_name, stats, args.poll_interval, args.idle_timeout)
+        try:
+            result = follow_evaluate(benchmark, batches, args.threshold, args.report_interval, args.status_json)
+        except Exception as e:
+            print(f"Ошибка при оценке в режиме слежения: {e}")
+            return
+        if stats['skipped_rows']:
+            print(f"Предупреждение: {stats['skipped_rows']} строк детектора пропущены из-за некорректных координат.")
+        matched = result['matched_benchmark']['c-match']
+        report_evaluation(result, args.threshold, benchmark.sampling_summary(matched), benchmark.clone_type_summary(matched))
+        return
+
+    if args.tool_csv:
+        print(f"Оценка внешней сортировкой и слиянием: {args.tool_csv} (лимит памяти {args.memory_limit} МБ)")
+        if not os.path.exists(args.tool_csv):
+            print(f"Ошибка: Результаты детектора не найдены: {args.tool_csv}")
+            return
+        # Индекс используется, только если уже актуален: его сборка требует загрузки эталона в память
+        benchmark_index = None
+        if not args.no_index:
+            benchmark_index = open_benchmark_index(args.benchmark_csv, build=args.rebuild_index, rebuild=args.rebuild_index)
+        if benchmark_index is not None:
+            print(f"Эталон читается из индекса: {benchmark_index.index_dir}")
+        try:
+            result = evaluate_sort_merge(
+                args.benchmark_csv, args.tool_csv, args.threshold, args.memory_limit, args.tmp_dir, benchmark_index
+            )
+        except Exception as e:
+            print(f"Ошибка при оценке результатов детектора из CSV: {e}")
+            return
+        matched = result['matched_benchmark']['c-match']
+        if benchmark_index is not None:
+            sampling_summary = benchmark_index.sampling_summary(matched)
+            clone_type_summary = benchmark_index.clone_type_summary(matched)
+        else:
+            sampling_weights = load_sampling_weights(args.benchmark_csv)
+            sampling_summary = summarize_sampling_weights(sampling_weights, matched) if sampling_weights is not None else None
+            clone_types = load_clone_types(args.benchmark_csv)
+            clone_type_summary = summarize_clone_types(clone_types, matched) if clone_types is not None else None
+        negative_summary = None
+        if args.negatives_csv:
+            try:
+                tool_rows = iter_detector_csv_rows(list_detector_csv_files(args.tool_csv), {'skipped_rows': 0})
+                negative_summary = negative_pairs_summary(args.negatives_csv, tool_rows, args.threshold)
+            except Exception as e:
+                print(f"Ошибка при оценке отрицательных пар: {e}")
+                return
+        report_evaluation(result, args.threshold, sampling_summary, clone_type_summary, negative_summary)
+        return
+
+    try:
+        print(f"Директория скрипта: {SCRIPT_DIR}")
+        benchmark = load_benchmark(args.benchmark_csv, use_index=not args.no_index, rebuild_index=args.rebuild_index)
+    except Exception as e:
+        print(f"Ошибка при чтении или разрешении путей в эталонном CSV: {e}")
+        return
+    print(f"Загружено эталонных пар: {benchmark.total} ({len(benchmark)} пар файлов)")
+
+    print(f"Загрузка результатов детектора из БД: {args.tool_db}, таблица: {args.tool_table_name}")
+    if not os.path.exists(args.tool_db):
+        print(f"Ошибка: Файл БД детектора не найден: {args.tool_db}")
+        return
+
+    print("\nНачинаем сопоставление клонов...")
+    # Пути нормализуются, и пары группируются по каноническому ключу (путь1, путь2):
+    # сопоставляются только группы, присутствующие и в эталоне, и в результатах детектора.
+    stats = {'skipped_rows': 0}
+    try:
+        result = evaluate_tool_rows(benchmark, iter_detector_db_rows(args.tool_db, args.tool_table_name, stats), args.threshold)
+    except Exception as e:
+        print(f"Ошибка при чтении или разрешении путей в БД детектора: {e}")
+        return
+    if stats['skipped_rows']:
+        print(f"Предупреждение: {stats['skipped_rows']} строк детектора пропущены из-за некорректных координат.")
+
+    negative_summary = None
+    if args.negatives_csv:
+        try:
+            tool_rows = iter_detector_db_rows(args.tool_db, args.tool_table_name)
+            negative_summary = negative_pairs_summary(args.negatives_csv, tool_rows, args.threshold)
+        except Exception as e:
+            print(f"Ошибка при оценке отрицательных пар: {e}")
+            return
+
+    matched = result['matched_benchmark']['c-match']
+    report_evaluation(result, args.threshold, benchmark.sampling_summary(matched), benchmark.clone_type_summary(matched),
+                      negative_summary)
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
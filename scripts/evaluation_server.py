@@ -0,0 +1,302 @@
+import asyncio
+import argparse
+import io
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from evaluate_clones import (
+    REQUIRED_TOOL_COLUMNS,
+    evaluate_tool_rows,
+    evaluation_metrics,
+    iter_detector_csv_rows,
+    iter_detector_csv_stream,
+    iter_detector_db_rows,
+    list_detector_csv_files,
+    load_benchmark,
+)
+
+# Размер порции чтения тела запроса
+READ_CHUNK_BYTES = 1024 * 1024
+# Тело запроса до этого размера держится в памяти, больше - сбрасывается во временный файл
+SPOOL_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+def parse_threshold(value):
+    """
+    Порог из запроса (число в JSON или строка параметра ?threshold=). None - использовать порог сервера.
+    Бросает ValueError для нечисловых значений и значений вне [0, 1] (ответ 400, а не 500).
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Некорректный порог: {value!r}")
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный порог: {value!r}") from None
+    if not 0 <= threshold <= 1: # NaN тоже не проходит сравнение
+        raise ValueError(f"Порог должен быть в диапазоне [0, 1]: {value!r}")
+    return threshold
+
+def check_tool_table(db_path, table_name):
+    """Проверяет, что в БД детектора есть таблица table_name со всеми нужными колонками. Иначе бросает ValueError."""
+    if not isinstance(table_name, str) or not table_name.isidentifier():
+        raise ValueError(f"Некорректное имя таблицы: {table_name!r}")
+    conn = sqlite3.connect(db_path)
+    try:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Не удалось прочитать таблицу {table_name} из БД {db_path}: {e}") from None
+    finally:
+        conn.close()
+    if not columns:
+        raise ValueError(f"Таблица {table_name} не найдена в БД детектора: {db_path}")
+    missing_columns = [col for col in REQUIRED_TOOL_COLUMNS if col not in columns]
+    if missing_columns:
+        raise ValueError(f"В таблице {table_name} отсутствуют необходимые колонки: {', '.join(missing_columns)}")
+
+class WarmBenchmark:
+    """
+    Эталонный бенчмарк, загруженный один раз на все время работы сервера (постоянный индекс
+    или группировка в памяти, см. evaluate_clones.load_benchmark), и кэш разрешенных путей детектора
+    (resolve_tool_path в evaluate_clones.py кэшируется на процесс).
+    Структуры только читаются, поэтому оценки можно безопасно выполнять в нескольких потоках
+    (из-за GIL они чередуются, а не идут параллельно).
+    """
+
+    def __init__(self, benchmark_csv, threshold, use_index=True):
+        started = time.perf_counter()
+        self.benchmark_csv = os.path.abspath(benchmark_csv)
+        self.threshold = threshold
+        self.benchmark = load_benchmark(benchmark_csv, use_index=use_index)
+        self.total = self.benchmark.total
+        self.load_seconds = time.perf_counter() - started
+
+    def evaluate(self, tool_rows, threshold=None, stats=None):
+        """Оценивает поток пар детектора и возвращает словарь метрик."""
+        threshold = self.threshold if threshold is None else threshold
+        started = time.perf_counter()
+        result = evaluate_tool_rows(self.benchmark, tool_rows, threshold)
+        matched = result['matched_benchmark']['c-match']
+        metrics = evaluation_metrics(result, threshold, self.benchmark.sampling_summary(matched), self.benchmark.clone_type_summary(matched))
+        metrics['benchmark_csv'] = self.benchmark_csv
+        metrics['skipped_rows'] = stats['skipped_rows'] if stats else 0
+        metrics['evaluation_seconds'] = time.perf_counter() - started
+        return metrics
+
+    def evaluate_request(self, request):
+        """
+        Оценка по JSON запросу: {"tool_csv": путь} или {"tool_db": путь, "tool_table_name": ...}, опционально "threshold".
+        Ошибки в запросе (некорректный порог, нет файла или таблицы) бросаются как ValueError.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("Тело запроса должно быть JSON объектом.")
+        threshold = parse_threshold(request.get('threshold'))
+        for field in ('tool_csv', 'tool_db'):
+            if request.get(field) is not None and not isinstance(request[field], str):
+                raise ValueError(f"'{field}' должен быть строкой с путем.")
+        if request.get('tool_csv'):
+            if not os.path.exists(request['tool_csv']):
+                raise ValueError(f"Результаты детектора не найдены: {request['tool_csv']}")
+            stats = {'skipped_rows': 0}
+            csv_files = list_detector_csv_files(request['tool_csv'])
+            return self.evaluate(iter_detector_csv_rows(csv_files, stats), threshold, stats)
+        if request.get('tool_db'):
+            if not os.path.exists(request['tool_db']):
+                raise ValueError(f"Файл БД детектора не найден: {request['tool_db']}")
+            table_name = request.get('tool_table_name', 'detected_clones')
+            check_tool_table(request['tool_db'], table_name)
+            stats = {'skipped_rows': 0}
+            return self.evaluate(iter_detector_db_rows(request['tool_db'], table_name, stats), threshold, stats)
+        raise ValueError("В запросе должен быть указан 'tool_csv' или 'tool_db'.")
+
+    def evaluate_stream(self, body_file, threshold=None):
+        """Оценка по CSV, переданному в теле запроса."""
+        stats = {'skipped_rows': 0}
+        body_file.seek(0)
+        text = io.TextIOWrapper(body_file, encoding='utf-8', newline='')
+        rows = ((seq,) + row for seq, row in enumerate(iter_detector_csv_stream(text, 'тела запроса', stats)))
+        return self.evaluate(rows, threshold, stats)
+
+async def read_request_head(reader):
+    """Читает строку запроса и заголовки HTTP. Возвращает (метод, путь, заголовки) или None при закрытом соединении."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    if len(parts) != 3:
+        raise ValueError(f"Некорректная строка запроса: {request_line[:100]!r}")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method.upper(), target, headers
+
+async def read_request_body(reader, headers, out):
+    """
+    Потоково копирует тело запроса в файловый объект out (Content-Length или Transfer-Encoding: chunked),
+    не держа его целиком в памяти.
+    """
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # Завершающие заголовки (trailers) до пустой строки
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            while size > 0:
+                chunk = await reader.read(min(size, READ_CHUNK_BYTES))
+                if not chunk:
+                    raise ConnectionError("Соединение закрыто до окончания тела запроса.")
+                out.write(chunk)
+                size -= len(chunk)
+            await reader.readline()
+    remaining = int(headers.get('content-length', 0))
+    while remaining > 0:
+        chunk = await reader.read(min(remaining, READ_CHUNK_BYTES))
+        if not chunk:
+            raise ConnectionError("Соединение закрыто до окончания тела запроса.")
+        out.write(chunk)
+        remaining -= len(chunk)
+
+def write_json_response(writer, status, payload):
+    body = json.dumps(payload, ensure_ascii=False, indent=2).encode('utf-8')
+    writer.write(
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode('latin-1') + body
+    )
+
+def make_handler(benchmark, executor):
+    """
+    Обработчик соединений. Поддерживаемые запросы:
+    GET  /health   - состояние сервера и размер загруженного бенчмарка;
+    POST /evaluate - JSON с путем к результатам детектора или CSV в теле запроса (Content-Type: text/csv,
+                     порог можно передать в параметре ?threshold=0.7).
+    """
+    async def handle(reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                # Некорректные строка запроса, заголовки, тело, JSON и порог - ошибки клиента (ValueError -> 400)
+                head = await read_request_head(reader)
+                if head is None:
+                    return
+                method, target, headers = head
+                path, _, query = target.partition('?')
+                params = dict(part.split('=', 1) for part in query.split('&') if '=' in part)
+
+                if path == '/health' and method == 'GET':
+                    write_json_response(writer, 200, {
+                        'status': 'ok',
+                        'benchmark_csv': benchmark.benchmark_csv,
+                        'total_benchmark': benchmark.total,
+                        'file_pairs': len(benchmark.benchmark),
+                        'load_seconds': benchmark.load_seconds,
+                    })
+                elif path == '/evaluate' and method == 'POST':
+                    content_type = headers.get('content-type', '').split(';', 1)[0].strip().lower()
+                    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES) as body:
+                        await read_request_body(reader, headers, body)
+                        if content_type == 'application/json':
+                            body.seek(0)
+                            request = json.loads(body.read().decode('utf-8') or '{}')
+                            job = lambda: benchmark.evaluate_request(request)
+                        else:
+                            threshold = parse_threshold(params.get('threshold'))
+                            job = lambda: benchmark.evaluate_stream(body, threshold)
+                        metrics = await loop.run_in_executor(executor, job)
+                    write_json_response(writer, 200, metrics)
+                elif path in ('/health', '/evaluate'):
+                    write_json_response(writer, 405, {'error': f"Метод {method} не поддерживается для {path}"})
+                else:
+                    write_json_response(writer, 404, {'error': f"Неизвестный путь: {path}"})
+            except ValueError as e:
+                write_json_response(writer, 400, {'error': str(e)})
+        except Exception as e:
+            write_json_response(writer, 500, {'error': f"{type(e).__name__}: {e}"})
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    return handle
+
+def is_unix_socket(path):
+    """Проверяет, что путь существует и является Unix сокетом (только такой файл сервер может удалить)."""
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+async def serve(benchmark, args):
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    handler = make_handler(benchmark, executor)
+    if args.unix_socket:
+        if is_unix_socket(args.unix_socket):
+            # Сокет, оставшийся от прежнего запуска
+            os.remove(args.unix_socket)
+        server = await asyncio.start_unix_server(handler, path=args.unix_socket)
+        print(f"Сервер оценки слушает Unix сокет: {args.unix_socket}")
+    else:
+        server = await asyncio.start_server(handler, host=args.host, port=args.port)
+        print(f"Сервер оценки слушает http://{args.host}:{args.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+        if args.unix_socket and is_unix_socket(args.unix_socket):
+            os.remove(args.unix_socket)
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Локальный сервер оценки: держит эталонный бенчмарк в памяти и оценивает результаты детектора "
+        "по запросу, возвращая метрики в JSON."
+    ))
+    parser.add_argument("--benchmark_csv", type=str, required=True, help="Путь к CSV файлу эталонного бенчмарка (например, clones_2017.csv).")
+    parser.add_argument("--threshold", type=float, default=0.7, help="Порог покрытия по умолчанию (по умолчанию 0.7).")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Адрес для HTTP (по умолчанию 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="Порт для HTTP (по умолчанию 8765).")
+    parser.add_argument("--unix_socket", type=str, default=None, help="Путь к Unix сокету (вместо TCP порта).")
+    parser.add_argument("--workers", type=int, default=4, help=(
+        "Количество одновременно принимаемых оценок (по умолчанию 4). Оценки выполняются в потоках и из-за GIL "
+        "чередуются, а не ускоряются."
+    ))
+    parser.add_argument("--no_index", action="store_true", help="Не использовать постоянный индекс эталона (clones_ГОД.csv.index/).")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.benchmark_csv):
+        print(f"Ошибка: Файл эталонного бенчмарка не найден: {args.benchmark_csv}")
+        return
+    if args.unix_socket and os.path.lexists(args.unix_socket) and not is_unix_socket(args.unix_socket):
+        print(f"Ошибка: {args.unix_socket} существует и не является Unix сокетом; укажите другой путь для --unix_socket.")
+        return
+
+    print(f"Загрузка эталонного бенчмарка в память: {args.benchmark_csv}")
+    benchmark = WarmBenchmark(args.benchmark_csv, args.threshold, use_index=not args.no_index)
+    print(f"Загружено эталонных пар: {benchmark.total} ({len(benchmark.benchmark)} пар файлов) за {benchmark.load_seconds:.2f} с")
+
+    try:
+        asyncio.run(serve(benchmark, args))
+    except KeyboardInterrupt:
+        print("\nСервер остановлен.")
+
+if __name__ == '__main__':
+    main()
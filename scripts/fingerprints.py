@@ -0,0 +1,28 @@
+import numpy as np
+
+# Общие хеш-функции отпечатков кода: ключи пар в compare_runs.py, n-граммы токенов в label_clone_types.py,
+# MinHash-сигнатуры отрицательных пар в build_benchmark.py
+
+# Множитель полиномиального хеша n-грамм (арифметика по модулю 2^64)
+NGRAM_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+
+def mix64(x):
+    """Финализатор splitmix64: перемешивает биты массива uint64 (арифметика по модулю 2^64)."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def ngram_profile(ids, n):
+    """
+    Мультимножество n-грамм токенов: (отсортированные уникальные хеши n-грамм, их количества).
+    Для фрагментов короче n используются n-граммы длины фрагмента.
+    """
+    n = min(n, len(ids))
+    if n == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    ids = ids.astype(np.uint64)
+    count = len(ids) - n + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for k in range(n):
+        hashes = hashes * NGRAM_HASH_MULTIPLIER + ids[k:k + count]
+    return np.unique(hashes, return_counts=True)
@@ -0,0 +1,210 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from evaluate_clones import extract_task_id_from_path, parse_coord
+from fingerprints import ngram_profile
+from token_cache import DEFAULT_CACHE_DIR, TokenCache, TokenStream, tokenize_source
+
+# Типы клонов (Roy & Cordy): 1 - идентичны без учета форматирования и комментариев,
+# 2 - идентичны после нормализации идентификаторов и литералов, 3 - с изменениями (сходство >= порога),
+# 4 - функционально схожие решения одной задачи с низким синтаксическим сходством. 0 - не удалось разобрать.
+CLONE_TYPE_UNKNOWN = 0
+# Корень проекта: относительные пути эталонного CSV записаны build_benchmark.py относительно него
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def profile_similarity(profile_1, profile_2):
+    """
+    Сходство двух фрагментов: доля общих n-грамм (пересечение мультимножеств) от большего фрагмента,
+    т.е. минимум из долей, которые каждый фрагмент разделяет с другим (как в BigCloneBench).
+    """
+    values_1, counts_1 = profile_1
+    values_2, counts_2 = profile_2
+    total = max(int(counts_1.sum()), int(counts_2.sum()))
+    if total == 0:
+        return 1.0
+    if len(values_1) == 0 or len(values_2) == 0:
+        return 0.0
+    # Оба профиля отсортированы: пересечение бинарным поиском без повторной сортировки
+    idx = np.searchsorted(values_2, values_1).clip(max=len(values_2) - 1)
+    found = values_2[idx] == values_1
+    return float(np.minimum(counts_1[found], counts_2[idx[found]]).sum()) / total
+
+def classify_pair(stream_1, frag_1, stream_2, frag_2, profile_1, profile_2, type3_threshold):
+    r"""
+    Возвращает (тип клона, сходство) для пары фрагментов (frag - срез токенов (i, j)).
+    Фрагменты включают последнюю строку, поэтому пары, различающиеся только ею, не считаются Type-1
+    (проверка: python -m doctest label_clone_types.py):
+
+    >>> s1 = TokenStream(*tokenize_source(b"a = 1\nwhile True:\n    pass"))
+    >>> s2 = TokenStream(*tokenize_source(b'a = 1\nwhile True:\n    print(undefined_name + 42, "x")'))
+    >>> f1, f2 = s1.fragment(0, 2), s2.fragment(0, 2)
+    >>> p1, p2 = ngram_profile(s1.normalized[f1[0]:f1[1]], 4), ngram_profile(s2.normalized[f2[0]:f2[1]], 4)
+    >>> classify_pair(s1, f1, s2, f2, p1, p2, 0.5)[0]
+    4
+    """
+    i1, j1 = frag_1
+    i2, j2 = frag_2
+    similarity = profile_similarity(profile_1, profile_2)
+    if np.array_equal(stream_1.raw[i1:j1], stream_2.raw[i2:j2]):
+        return 1, similarity
+    if np.array_equal(stream_1.normalized[i1:j1], stream_2.normalized[i2:j2]):
+        return 2, similarity
+    return (3 if similarity >= type3_threshold else 4), similarity
+
+def label_task_pairs(rows, cache_dir, ngram, type3_threshold):
+    """
+    Размечает пары одной задачи. rows - список (номер строки, путь1, start1, end1, путь2, start2, end2).
+    Каждый файл токенизируется не более одного раза (через кэш), профили n-грамм фрагментов переиспользуются.
+    Возвращает: (список (номер строки, тип, сходство или None),
+                 (попаданий в кэш, промахов, неразобранных файлов, ненайденных файлов, всего файлов))
+    """
+    cache = TokenCache(cache_dir)
+    streams = {}
+    profiles = {}
+
+    def fragment(path, start, end):
+        if path not in streams:
+            streams[path] = cache.get(path)
+        stream = streams[path]
+        if stream is None:
+            return None, None, None
+        frag = stream.fragment(start, end)
+        key = (path,) + frag
+        if key not in profiles:
+            profiles[key] = ngram_profile(stream.normalized[frag[0]:frag[1]], ngram)
+        return stream, frag, profiles[key]
+
+    results = []
+    for seq, p1, s1, e1, p2, s2, e2 in rows:
+        stream_1, frag_1, profile_1 = fragment(p1, s1, e1)
+        stream_2, frag_2, profile_2 = fragment(p2, s2, e2)
+        if stream_1 is None or stream_2 is None:
+            results.append((seq, CLONE_TYPE_UNKNOWN, None))
+            continue
+        clone_type, similarity = classify_pair(stream_1, frag_1, stream_2, frag_2, profile_1, profile_2, type3_threshold)
+        results.append((seq, clone_type, similarity))
+    return results, (cache.hits, cache.misses, cache.failures, cache.missing, len(streams))
+
+def resolve_solution_path(path):
+    """Путь к решению из эталонного CSV: относительные пути разрешаются от корня проекта (как в build_benchmark.py)."""
+    return os.path.normpath(os.path.join(PROJECT_ROOT, path))
+
+def read_benchmark_tasks(benchmark_csv):
+    """
+    Читает эталонный CSV и группирует пары по задачам.
+    Возвращает: (словарь {task_id: [(номер строки, путь1, start1, end1, путь2, start2, end2), ...]}, всего пар)
+    Строки с некорректными координатами не размечаются.
+    """
+    tasks = {}
+    total = 0
+    with open(benchmark_csv, 'r', encoding='utf-8', newline='') as f:
+        for seq, row in enumerate(csv.DictReader(f)):
+            total += 1
+            coords = [parse_coord(row[col]) for col in ('file1_start', 'file1_end', 'file2_start', 'file2_end')]
+            if None in coords:
+                continue
+            task_id = row.get('task_id') or extract_task_id_from_path(row['file1_path']) or ''
+            tasks.setdefault(task_id, []).append((
+                seq, resolve_solution_path(row['file1_path']), coords[0], coords[1],
+                resolve_solution_path(row['file2_path']), coords[2], coords[3],
+            ))
+    return tasks, total
+
+def write_labeled_csv(benchmark_csv, output_csv, clone_types, similarities):
+    """Переписывает эталонный CSV с колонками clone_type и similarity (существующие колонки заменяются)."""
+    tmp_path = f"{output_csv}.tmp-{os.getpid()}"
+    with open(benchmark_csv, 'r', encoding='utf-8', newline='') as src, \
+         open(tmp_path, 'w', encoding='utf-8', newline='') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader)
+        keep = [i for i, name in enumerate(header) if name not in ('clone_type', 'similarity')]
+        writer.writerow([header[i] for i in keep] + ['clone_type', 'similarity'])
+        for seq, row in enumerate(reader):
+            clone_type = clone_types[seq]
+            similarity = similarities[seq]
+            writer.writerow([row[i] for i in keep] + [
+                clone_type if clone_type else '',
+                f"{similarity:.4f}" if similarity is not None else '',
+            ])
+    os.replace(tmp_path, output_csv)
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Разметка эталонных пар по типам клонов (Type-1/2/3/4) по сходству нормализованных токенов. "
+        "Добавляет в эталонный CSV колонки clone_type и similarity, по которым evaluate_clones.py выводит полноту по типам."
+    ))
+    parser.add_argument("--benchmark_csv", type=str, required=True, help="Путь к CSV файлу эталонного бенчмарка (например, clones_2017.csv).")
+    parser.add_argument("--output_csv", type=str, default=None, help="Куда записать размеченный CSV (по умолчанию эталонный CSV перезаписывается).")
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Директория кэша токенов (по умолчанию data/token_cache).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Количество процессов разметки (по умолчанию число ядер).")
+    parser.add_argument("--ngram", type=int, default=4, help="Длина n-грамм токенов для расчета сходства (по умолчанию 4).")
+    parser.add_argument("--type3_threshold", type=float, default=0.5, help=(
+        "Минимальное сходство для Type-3; пары ниже порога считаются Type-4 (по умолчанию 0.5, как граница MT3/WT3 в BigCloneBench)."
+    ))
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.benchmark_csv):
+        print(f"Ошибка: Файл эталонного бенчмарка не найден: {args.benchmark_csv}")
+        return
+    output_csv = args.output_csv or args.benchmark_csv
+
+    started = time.perf_counter()
+    tasks, total = read_benchmark_tasks(args.benchmark_csv)
+    print(f"Эталонных пар: {total}, задач: {len(tasks)}")
+
+    clone_types = [CLONE_TYPE_UNKNOWN] * total
+    similarities = [None] * total
+    cache_stats = [0, 0, 0, 0, 0]
+
+    def collect(task_results):
+        results, stats = task_results
+        for seq, clone_type, similarity in results:
+            clone_types[seq] = clone_type
+            similarities[seq] = similarity
+        for i, value in enumerate(stats):
+            cache_stats[i] += value
+
+    # Крупные задачи запускаются первыми, чтобы последняя не задерживала завершение
+    ordered_tasks = sorted(tasks.values(), key=len, reverse=True)
+    if args.workers <= 1:
+        for rows in tqdm(ordered_tasks, desc="Разметка задач"):
+            collect(label_task_pairs(rows, args.cache_dir, args.ngram, args.type3_threshold))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(label_task_pairs, rows, args.cache_dir, args.ngram, args.type3_threshold)
+                       for rows in ordered_tasks]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Разметка задач"):
+                collect(future.result())
+
+    hits, misses, failures, missing, files = cache_stats
+    if files and missing == files:
+        # Скорее всего, эталон перенесен или решения не извлечены: не перезаписываем эталон пустой разметкой
+        print(f"Ошибка: Не найден ни один из {files} файлов решений (пути разрешаются от корня проекта {PROJECT_ROOT}). "
+              f"Разметка не сохранена.")
+        sys.exit(1)
+
+    write_labeled_csv(args.benchmark_csv, output_csv, clone_types, similarities)
+
+    print(f"\nКэш токенов: {os.path.abspath(args.cache_dir)} (попаданий: {hits}, токенизировано: {misses}, "
+          f"не удалось разобрать: {failures})")
+    if missing:
+        print(f"Предупреждение: не найдено файлов решений: {missing} из {files}, их пары не размечены.")
+    print("Распределение пар по типам клонов:")
+    counts = np.bincount(np.array(clone_types, dtype=np.int64), minlength=5)
+    for clone_type in range(1, 5):
+        print(f"  Type-{clone_type}: {counts[clone_type]}")
+    if counts[CLONE_TYPE_UNKNOWN]:
+        print(f"  Не размечено: {counts[CLONE_TYPE_UNKNOWN]}")
+    print(f"Размеченный бенчмарк сохранен: {output_csv} за {time.perf_counter() - started:.2f} с")
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,55 @@ import pandas as pd
 import argparse
 import os
 
+REQUIRED_COLUMNS = ['file1_path', 'file1_start', 'file1_end', 'file2_path', 'file2_start', 'file2_end']
+COORD_COLUMNS = ['file1_start', 'file1_end', 'file2_start', 'file2_end']
+
+def prepare_detector_results(df):
+    """
+    Проверяет колонки и приводит координаты результатов детектора к int.
+    Строки с нечисловыми координатами удаляются.
+    Возвращает: (DataFrame только с необходимыми колонками, количество удаленных строк)
+    Бросает ValueError, если необходимых колонок нет.
+    """
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"В CSV файле отсутствуют необходимые колонки: {', '.join(missing_columns)}")
+
+    df = df[REQUIRED_COLUMNS].copy()
+    # errors='coerce' заменит нечисловые значения на NaN
+    for col in COORD_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    original_rows = len(df)
+    df.dropna(subset=COORD_COLUMNS, inplace=True)
+    # Преобразуем в int после удаления NaN
+    for col in COORD_COLUMNS:
+        df[col] = df[col].astype(int)
+    return df, original_rows - len(df)
+
+def create_results_table(cursor, table_name, drop_existing=True):
+    """Создает таблицу результатов детектора (по умолчанию удаляя существующую для полной перезаписи)."""
+    if drop_existing:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file1_path TEXT NOT NULL,
+        file1_start INTEGER NOT NULL,
+        file1_end INTEGER NOT NULL,
+        file2_path TEXT NOT NULL,
+        file2_start INTEGER NOT NULL,
+        file2_end INTEGER NOT NULL
+    )
+    """)
+
 def main():
     parser = argparse.ArgumentParser(description="Загрузка результатов работы детектора клонов из CSV в базу данных SQLite.")
     parser.add_argument("--csv_file", type=str, required=True, help="Путь к CSV файлу с результатами детектора.")
     parser.add_argument("--db_file", type=str, required=True, help="Путь к файлу базы данных SQLite.")
+    parser.add_argument("--table_name", type=str, default="detected_clones", help=(
+        "Имя таблицы для результатов (по умолчанию detected_clones). Разные имена позволяют хранить несколько прогонов "
+        "детектора в одной БД, например для сравнения в compare_runs.py."
+    ))
     
     args = parser.parse_args()
 
@@ -31,26 +76,15 @@ def main():
         print(f"Заголовки в CSV: {df.columns.tolist()}")
         print(f"Прочитано строк (без заголовка): {len(df)}")
 
-        # Проверяем наличие необходимых колонок
-        required_columns = ['file1_path', 'file1_start', 'file1_end', 'file2_path', 'file2_start', 'file2_end']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            print(f"Ошибка: В CSV файле отсутствуют необходимые колонки: {', '.join(missing_columns)}")
-            return
-            
-        # Преобразуем колонки с координатами в числовые, обрабатывая возможные ошибки
-        for col in ['file1_start', 'file1_end', 'file2_start', 'file2_end']:
-            df[col] = pd.to_numeric(df[col], errors='coerce') # errors='coerce' заменит нечисловые значения на NaN
-        
-        # Удаляем строки, где координаты не удалось преобразовать в числа
+        # Проверяем наличие необходимых колонок и преобразуем координаты в числовые
         original_rows = len(df)
-        df.dropna(subset=['file1_start', 'file1_end', 'file2_start', 'file2_end'], inplace=True)
-        if len(df) < original_rows:
-            print(f"Предупреждение: {original_rows - len(df)} строк были удалены из-за некорректных (нечисловых) значений в колонках координат.")
-
-        # Преобразуем в int после удаления NaN
-        for col in ['file1_start', 'file1_end', 'file2_start', 'file2_end']:
-            df[col] = df[col].astype(int)
+        try:
+            df, dropped_rows = prepare_detector_results(df)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        if dropped_rows:
+            print(f"Предупреждение: {dropped_rows} строк были удалены из-за некорректных (нечисловых) значений в колонках координат.")
 
     except Exception as e:
         print(f"Ошибка при чтении или обработке CSV файла {args.csv_file}: {e}")
@@ -69,24 +103,11 @@ def main():
         conn = sqlite3.connect(args.db_file)
         cursor = conn.cursor()
         
-        table_name = "detected_clones"
+        table_name = args.table_name
 
-        # Удаляем таблицу, если она существует, для полной перезаписи
-        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        # Удаляем таблицу, если она существует, для полной перезаписи, и создаем заново
+        create_results_table(cursor, table_name)
         print(f"Таблица {table_name} удалена (если существовала).")
-
-        # Создаем таблицу
-        cursor.execute(f"""
-        CREATE TABLE {table_name} (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file1_path TEXT NOT NULL,
-            file1_start INTEGER NOT NULL,
-            file1_end INTEGER NOT NULL,
-            file2_path TEXT NOT NULL,
-            file2_start INTEGER NOT NULL,
-            file2_end INTEGER NOT NULL
-        )
-        """)
         print(f"Таблица {table_name} успешно создана.")
 
         # Загружаем данные из DataFrame в SQLite таблицу
@@ -0,0 +1,228 @@
+import argparse
+import os
+import shlex
+import shutil
+import signal
+import sqlite3
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+from load_tool_results_to_db import REQUIRED_COLUMNS, create_results_table, prepare_detector_results
+
+# Размер порции при загрузке вывода шарда в БД
+LOAD_CHUNK_ROWS = 100000
+# Подстановки, доступные в шаблоне команды детектора
+TEMPLATE_FIELDS = ('input_dir', 'output_csv', 'task_id', 'year', 'project_root')
+
+def list_shards(year_dir, tasks=None):
+    """Возвращает список (task_id, абсолютный путь к директории задачи) из extracted_solutions/ГОД."""
+    task_ids = sorted(name for name in os.listdir(year_dir) if os.path.isdir(os.path.join(year_dir, name)))
+    if tasks:
+        missing = sorted(set(tasks) - set(task_ids))
+        if missing:
+            print(f"Предупреждение: задачи не найдены в {year_dir}: {', '.join(missing)}")
+        task_ids = [task_id for task_id in task_ids if task_id in tasks]
+    return [(task_id, os.path.join(year_dir, task_id)) for task_id in task_ids]
+
+def build_command(template, **values):
+    """
+    Разбивает шаблон команды на аргументы (shlex) и подставляет значения в каждый из них.
+    Команда запускается без оболочки, поэтому пути с пробелами не требуют экранирования.
+    """
+    return [token.format(**values) for token in shlex.split(template)]
+
+def kill_process_tree(proc):
+    """Завершает детектор вместе с порожденными им процессами (он запускается в отдельной группе)."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+def run_shard(task_id, input_dir, args, project_root, output_dir):
+    """
+    Запускает детектор на одном шарде с таймаутом и повторными попытками.
+    Вывод детектора (stdout/stderr) пишется в лог рядом с CSV шарда.
+    Возвращает словарь с результатом: output_csv, attempts, error (None при успехе), seconds.
+    """
+    output_csv = os.path.join(output_dir, f"{task_id}.csv")
+    log_path = os.path.join(output_dir, f"{task_id}.log")
+    cmd = build_command(args.detector_cmd, input_dir=input_dir, output_csv=output_csv,
+                        task_id=task_id, year=args.year, project_root=project_root)
+    started = time.perf_counter()
+    error = None
+    for attempt in range(1, args.retries + 2):
+        if os.path.exists(output_csv):
+            os.remove(output_csv)
+        with open(log_path, 'ab') as log:
+            log.write(f"# Попытка {attempt}: {shlex.join(cmd)}\n".encode('utf-8'))
+            log.flush()
+            try:
+                proc = subprocess.Popen(cmd, cwd=project_root, stdout=log, stderr=subprocess.STDOUT,
+                                        stdin=subprocess.DEVNULL, start_new_session=True)
+            except OSError as e:
+                # Команда не найдена и т.п. - повторять бессмысленно
+                error = f"не удалось запустить детектор: {e}"
+                break
+            try:
+                returncode = proc.wait(timeout=args.timeout)
+            except subprocess.TimeoutExpired:
+                kill_process_tree(proc)
+                error = f"превышен таймаут {args.timeout} с"
+                continue
+        if returncode == 0:
+            error = None
+            break
+        error = f"код возврата {returncode} (см. {log_path})"
+    return {
+        'task_id': task_id,
+        'output_csv': output_csv,
+        'attempts': attempt,
+        'error': error,
+        'seconds': time.perf_counter() - started,
+    }
+
+def load_shard_output(conn, table_name, output_csv):
+    """
+    Загружает CSV шарда в таблицу результатов порциями в одной транзакции.
+    Если CSV оказывается некорректным посреди чтения, уже вставленные строки шарда откатываются.
+    Возвращает (загружено строк, удалено строк с некорректными координатами).
+    Отсутствующий или пустой CSV означает, что детектор не нашел клонов.
+    """
+    if not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0:
+        return 0, 0
+    # to_sql фиксирует каждую порцию отдельно, поэтому строки вставляются напрямую
+    insert_sql = (f"INSERT INTO {table_name} ({', '.join(REQUIRED_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' for _ in REQUIRED_COLUMNS)})")
+    loaded = dropped = 0
+    try:
+        for chunk in pd.read_csv(output_csv, dtype=str, chunksize=LOAD_CHUNK_ROWS):
+            chunk, chunk_dropped = prepare_detector_results(chunk)
+            dropped += chunk_dropped
+            if not chunk.empty:
+                conn.executemany(insert_sql, chunk.astype(object).itertuples(index=False, name=None))
+                loaded += len(chunk)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return loaded, dropped
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Параллельный запуск внешнего детектора клонов по задачам из extracted_solutions с загрузкой "
+        "результатов каждой задачи в БД сразу по ее завершении."
+    ))
+    parser.add_argument("--detector_cmd", type=str, required=True, help=(
+        "Шаблон команды детектора. Подстановки: {input_dir} - директория задачи, {output_csv} - куда записать CSV "
+        "(колонки file1_path, file1_start, file1_end, file2_path, file2_start, file2_end), {task_id}, {year}, {project_root}. "
+        "Например: \"python scripts/dummy_detector.py --input_dir {input_dir} --output_csv {output_csv}\"."
+    ))
+    parser.add_argument("--year", type=str, required=True, help="Год обрабатываемых данных (например, 2017).")
+    parser.add_argument("--extracted_solutions_dir", default="extracted_solutions", help=(
+        "Директория с извлеченными решениями (по умолчанию 'extracted_solutions'). "
+        "Относительный путь считается от корня проекта."
+    ))
+    parser.add_argument("--db_file", type=str, required=True, help="Путь к файлу SQLite базы данных для результатов.")
+    parser.add_argument("--table_name", type=str, default="detected_clones", help="Имя таблицы результатов (по умолчанию detected_clones).")
+    parser.add_argument("--append", action="store_true", help="Дописывать в существующую таблицу вместо ее перезаписи.")
+    parser.add_argument("--tasks", type=str, default=None, help="Список идентификаторов задач через запятую (по умолчанию все).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Количество одновременно работающих детекторов (по умолчанию число ядер).")
+    parser.add_argument("--timeout", type=float, default=None, help="Таймаут одного запуска детектора на задаче в секундах (по умолчанию без ограничения).")
+    parser.add_argument("--retries", type=int, default=1, help="Количество повторных попыток при ошибке или таймауте (по умолчанию 1).")
+    parser.add_argument("--output_dir", type=str, default=None, help=(
+        "Директория для CSV и логов детектора по задачам. По умолчанию используется временная директория, "
+        "которая удаляется после загрузки."
+    ))
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        print("Ошибка: --workers должен быть не меньше 1.")
+        return
+    if args.retries < 0:
+        print("Ошибка: --retries должен быть не меньше 0.")
+        return
+
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.abspath(os.path.join(scripts_dir, '..'))
+    year_dir = os.path.join(project_root, args.extracted_solutions_dir, args.year)
+    if not os.path.isdir(year_dir):
+        print(f"Ошибка: Директория с решениями не найдена: {year_dir}")
+        print("Сначала запустите build_benchmark.py для извлечения решений.")
+        return
+
+    try:
+        build_command(args.detector_cmd, **{field: '' for field in TEMPLATE_FIELDS})
+    except (KeyError, IndexError, ValueError) as e:
+        print(f"Ошибка: Некорректный шаблон команды детектора ({type(e).__name__}: {e}). "
+              f"Доступные подстановки: {', '.join('{' + field + '}' for field in TEMPLATE_FIELDS)}")
+        return
+
+    tasks = set(args.tasks.split(',')) if args.tasks else None
+    shards = list_shards(year_dir, tasks)
+    if not shards:
+        print("Нет задач для запуска детектора.")
+        return
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='run_detector_')
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Задач: {len(shards)}, параллельных запусков: {args.workers}, выходные файлы: {output_dir}")
+
+    conn = sqlite3.connect(args.db_file)
+    create_results_table(conn.cursor(), args.table_name, drop_existing=not args.append)
+    conn.commit()
+
+    started = time.perf_counter()
+    total_loaded = total_dropped = 0
+    failed = []
+    try:
+        # Каждый шард - отдельный процесс детектора; потоки пула только ждут их завершения,
+        # а основной поток загружает в БД вывод уже завершившихся шардов, пока остальные еще работают.
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(run_shard, task_id, input_dir, args, project_root, output_dir)
+                       for task_id, input_dir in shards]
+            with tqdm(total=len(futures), desc="Запуск детектора") as progress:
+                for future in as_completed(futures):
+                    shard = future.result()
+                    if shard['error']:
+                        failed.append(shard)
+                        tqdm.write(f"Задача {shard['task_id']}: ошибка после {shard['attempts']} попыток: {shard['error']}")
+                    else:
+                        try:
+                            loaded, dropped = load_shard_output(conn, args.table_name, shard['output_csv'])
+                        except (ValueError, pd.errors.ParserError) as e:
+                            shard['error'] = f"некорректный CSV детектора: {e}"
+                            failed.append(shard)
+                            tqdm.write(f"Задача {shard['task_id']}: {shard['error']}")
+                        else:
+                            total_loaded += loaded
+                            total_dropped += dropped
+                            if not args.output_dir:
+                                os.remove(shard['output_csv'])
+                    progress.update(1)
+    finally:
+        conn.close()
+        if not args.output_dir:
+            if failed:
+                print(f"Логи задач с ошибками сохранены в {output_dir}")
+            else:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+    print(f"\nЗагружено строк в таблицу {args.table_name}: {total_loaded}")
+    if total_dropped:
+        print(f"Предупреждение: {total_dropped} строк были удалены из-за некорректных (нечисловых) значений в колонках координат.")
+    print(f"Успешно обработано задач: {len(shards) - len(failed)} из {len(shards)} за {time.perf_counter() - started:.2f} с")
+    if failed:
+        print(f"Задачи с ошибками: {', '.join(sorted(shard['task_id'] for shard in failed))}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import hashlib
+import io
+import keyword
+import os
+import sys
+import tempfile
+import token
+import tokenize
+import zlib
+
+import numpy as np
+
+# Версия нормализации токенов: входит в путь кэша, при изменении нормализации кэш собирается заново.
+# Вместе с ней в путь входит версия интерпретатора: модуль tokenize разных версий Python разбивает код по-разному
+TOKEN_CACHE_VERSION = 2
+TOKENIZER_VERSION = f"py{sys.version_info[0]}{sys.version_info[1]}"
+# Кэш по умолчанию: data/token_cache/ в корне проекта
+DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'token_cache'))
+
+# Токены, не влияющие на код: комментарии, пустые строки, служебные маркеры
+SKIPPED_TOKEN_TYPES = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+# f-строки (Python 3.12+) разбиваются на FSTRING_START, части текста, токены подстановок и FSTRING_END:
+# все токены от FSTRING_START до парного FSTRING_END сводятся к одному строковому литералу, как в Python 3.11
+FSTRING_START = getattr(token, 'FSTRING_START', None)
+FSTRING_END = getattr(token, 'FSTRING_END', None)
+
+def token_id(text):
+    """Стабильный 32-битный идентификатор токена (одинаковый во всех процессах и запусках)."""
+    return zlib.crc32(text.encode('utf-8', 'surrogatepass'))
+
+# Идентификаторы служебных и нормализованных токенов
+INDENT_ID = token_id('<INDENT>')
+DEDENT_ID = token_id('<DEDENT>')
+NEWLINE_ID = token_id('<NEWLINE>')
+NAME_ID = token_id('<ID>')
+NUMBER_ID = token_id('<NUM>')
+STRING_ID = token_id('<STR>')
+
+def tokenize_source(source):
+    """
+    Разбивает исходный код (bytes) на токены модулем tokenize.
+    Возвращает три массива uint32 одинаковой длины:
+    normalized - токены с идентификаторами, числами и строками, замененными на <ID>, <NUM>, <STR>;
+    raw - токены как есть (без комментариев и форматирования: отступы сводятся к <INDENT>/<DEDENT>);
+    lines - номер строки начала каждого токена, с 0 (как координаты в эталонном CSV).
+    Бросает tokenize.TokenError или SyntaxError, если код не удается разобрать.
+    """
+    normalized, raw, lines = [], [], []
+    fstring_depth = 0
+    fstring_parts = []
+    for tok in tokenize.tokenize(io.BytesIO(source).readline):
+        tok_type = tok.type
+        if tok_type == FSTRING_START:
+            if fstring_depth == 0:
+                fstring_line = tok.start[0]
+                fstring_parts = []
+            fstring_depth += 1
+        if fstring_depth:
+            # Текст f-строки вместе с подстановками - один литерал (вложенные f-строки учитываются глубиной)
+            fstring_parts.append(tok.string)
+            if tok_type == FSTRING_END:
+                fstring_depth -= 1
+                if fstring_depth == 0:
+                    normalized.append(STRING_ID)
+                    raw.append(token_id(''.join(fstring_parts)))
+                    lines.append(fstring_line - 1)
+            continue
+        if tok_type in SKIPPED_TOKEN_TYPES:
+            continue
+        if tok_type == tokenize.INDENT:
+            raw_id = norm_id = INDENT_ID
+        elif tok_type == tokenize.DEDENT:
+            raw_id = norm_id = DEDENT_ID
+        elif tok_type == tokenize.NEWLINE:
+            raw_id = norm_id = NEWLINE_ID
+        else:
+            raw_id = token_id(tok.string)
+            if tok_type == tokenize.NAME:
+                norm_id = raw_id if keyword.iskeyword(tok.string) else NAME_ID
+            elif tok_type == tokenize.NUMBER:
+                norm_id = NUMBER_ID
+            elif tok_type == tokenize.STRING:
+                norm_id = STRING_ID
+            else:
+                norm_id = raw_id
+        normalized.append(norm_id)
+        raw.append(raw_id)
+        lines.append(tok.start[0] - 1)
+    return (
+        np.array(normalized, dtype=np.uint32),
+        np.array(raw, dtype=np.uint32),
+        np.array(lines, dtype=np.uint32),
+    )
+
+class TokenStream:
+    """Токены одного файла из кэша: normalized, raw, lines (см. tokenize_source)."""
+
+    __slots__ = ('normalized', 'raw', 'lines')
+
+    def __init__(self, normalized, raw, lines):
+        self.normalized = normalized
+        self.raw = raw
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.normalized)
+
+    def fragment(self, start_line, end_line):
+        """Срез (i, j) токенов, начинающихся в строках [start_line, end_line] (с 0, включительно, как в эталонном CSV)."""
+        return (int(np.searchsorted(self.lines, start_line, 'left')),
+                int(np.searchsorted(self.lines, end_line, 'right')))
+
+class TokenCache:
+    """
+    Кэш токенов на диске с ключом по хешу содержимого файла: <cache_dir>/v<версия>-py<версия Python>/ab/abcdef....npz.
+    Одинаковые файлы разбираются один раз, а после изменения файла его токены просто берутся по новому хешу.
+    Записи пишутся атомарно (временный файл + os.replace), поэтому кэш можно заполнять из нескольких процессов.
+    Файлы, которые не удалось разобрать, кэшируются как неудачные и возвращаются как None.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = os.path.join(cache_dir, f"v{TOKEN_CACHE_VERSION}-{TOKENIZER_VERSION}")
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.missing = 0
+
+    def _entry_path(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}.npz")
+
+    def get(self, file_path):
+        """
+        Токены файла (TokenStream) или None, если файл не найден или не разбирается tokenize.
+        Ненайденные (непрочитанные) файлы учитываются в missing, неразобранные - в failures.
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                source = f.read()
+        except OSError:
+            self.missing += 1
+            return None
+        entry_path = self._entry_path(hashlib.blake2b(source, digest_size=16).hexdigest())
+        try:
+            with np.load(entry_path) as entry:
+                self.hits += 1
+                if entry['failed']:
+                    self.failures += 1
+                    return None
+                return TokenStream(entry['normalized'], entry['raw'], entry['lines'])
+        except (OSError, KeyError, ValueError):
+            pass
+
+        self.misses += 1
+        try:
+            normalized, raw, lines = tokenize_source(source)
+            failed = False
+        except (tokenize.TokenError, SyntaxError, UnicodeDecodeError):
+            normalized = raw = lines = np.empty(0, dtype=np.uint32)
+            failed = True
+        self._store(entry_path, normalized, raw, lines, failed)
+        if failed:
+            self.failures += 1
+            return None
+        return TokenStream(normalized, raw, lines)
+
+    def _store(self, entry_path, normalized, raw, lines, failed):
+        """Атомарно записывает запись кэша. Ошибки записи (нет места, нет прав) не мешают работе - токены просто не кэшируются."""
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, normalized=normalized, raw=raw, lines=lines, failed=np.array(failed))
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)